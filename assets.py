@@ -0,0 +1,82 @@
+from typing import NamedTuple
+
+from panda3d.core import NodePath
+
+from texture_manager import texture_manager
+
+
+class AssetManifest(NamedTuple):
+    """Args:
+            fonts (tuple): paths of the fonts.
+            models (tuple): paths of the models.
+            textures (tuple): glob patterns of the textures in texture_manager's directory.
+    """
+
+    fonts: tuple = ()
+    models: tuple = ()
+    textures: tuple = ()
+
+
+MANIFEST = AssetManifest(
+    fonts=('font/Candaral.ttf',),
+    models=('smiley',),
+    textures=('*.png',)
+)
+
+
+class AssetLoader:
+    """Load the assets of a manifest in the background, and keep them to share among their users.
+       An asset asked for before being loaded is loaded at once, or waited for if being loaded.
+    """
+
+    def __init__(self):
+        self.fonts = {}
+        self.models = {}
+        self.requests = {}
+
+    def load(self, manifest):
+        """Start loading the assets; fonts are loaded at once, as the first screen needs them."""
+        for path in manifest.fonts:
+            self.get_font(path)
+
+        for pattern in manifest.textures:
+            texture_manager.preload(pattern)
+
+        for path in manifest.models:
+            if path not in self.models and path not in self.requests:
+                self.requests[path] = base.loader.load_model(
+                    path, callback=self.model_loaded, extraArgs=[path])
+
+    def model_loaded(self, model, path):
+        if self.requests.pop(path, None) is not None:
+            self.models[path] = model
+
+    def get_font(self, path):
+        if (font := self.fonts.get(path)) is None:
+            font = self.fonts[path] = base.loader.load_font(path)
+
+        return font
+
+    def get_model(self, path):
+        """Return a copy of the model, like loader.loadModel, so that each user can change its own."""
+        if (model := self.models.get(path)) is None:
+            if (request := self.requests.pop(path, None)) is not None:
+                model = request.result()
+            else:
+                model = base.loader.load_model(path)
+
+            self.models[path] = model
+
+        return model.copy_to(NodePath())
+
+    def is_loaded(self):
+        return not self.requests and texture_manager.is_loaded()
+
+    def progress(self):
+        """Return the number of assets loaded and the number requested."""
+        tex_loaded, tex_total = texture_manager.progress()
+        loaded = len(self.fonts) + len(self.models)
+        return loaded + tex_loaded, loaded + len(self.requests) + tex_total
+
+
+assets = AssetLoader()
@@ -0,0 +1,173 @@
+"""Play seeded games in parallel processes, each having its own headless game, and report the results.
+   Run from the repository root:
+       python batch.py --games 100 --workers 8 --policy greedy --report report.json
+       python batch.py --games 100 --spawn-counts 25,35 20,30 10,20
+       python batch.py --games 100 --spawn-rate 30,2
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import statistics
+import time
+
+from drops import SPAWN_COUNTS, SPAWN_RATE
+from headless import HeadlessGame, POLICIES
+
+
+# the headless game of a worker process; ShowBase can be created only once in a process.
+worker_game = None
+worker_policy = None
+
+
+def init_worker(policy_name, spawn_counts, spawn_rate):
+    global worker_game, worker_policy
+
+    worker_policy = POLICIES[policy_name]
+    worker_game = HeadlessGame(spawn_counts=spawn_counts, spawn_rate=spawn_rate)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def play(seed, max_frames):
+    # the policy is seeded too, so that a game is reproducible with its seed.
+    worker_game.policy = worker_policy(rng=random.Random(seed))
+    result = worker_game.play(max_frames, seed)
+    frame_times = sorted(worker_game.frame_times)
+
+    return dict(
+        seed=seed,
+        score=result.score,
+        merges=result.merges,
+        frames=result.frames,
+        finished=result.finished,
+        wall_time=result.wall_time,
+        frame_mean=result.wall_time / max(result.frames, 1),
+        frame_p95=percentile(frame_times, 0.95),
+        frame_p99=percentile(frame_times, 0.99),
+        frame_max=frame_times[-1] if frame_times else 0,
+        spawn_latency=result.spawn_latency,
+        max_queued=result.max_queued
+    )
+
+
+def summarize(values):
+    """Return the mean of values with its 95% confidence interval."""
+    mean = statistics.fmean(values)
+    stdev = statistics.stdev(values) if len(values) > 1 else 0
+    half_width = 1.96 * stdev / math.sqrt(len(values))
+
+    return dict(
+        mean=mean,
+        stdev=stdev,
+        min=min(values),
+        max=max(values),
+        ci95=(mean - half_width, mean + half_width)
+    )
+
+
+def make_report(games, config, wall_time):
+    frames = sum(g['frames'] for g in games)
+
+    return dict(
+        config=config,
+        summary=dict(
+            score=summarize([g['score'] for g in games]),
+            merges=summarize([g['merges'] for g in games]),
+            frames=summarize([g['frames'] for g in games]),
+            finished=sum(g['finished'] for g in games),
+            frame_mean=summarize([g['frame_mean'] for g in games]),
+            frame_p95=summarize([g['frame_p95'] for g in games]),
+            frame_p99=summarize([g['frame_p99'] for g in games]),
+            frame_max=max(g['frame_max'] for g in games),
+            spawn_latency=summarize([g['spawn_latency'] for g in games]),
+            max_queued=max(g['max_queued'] for g in games),
+            wall_time=wall_time,
+            frames_per_sec=frames / wall_time
+        ),
+        games=sorted(games, key=lambda g: g['seed'])
+    )
+
+
+def run(games, workers=None, seed=0, policy='random', max_frames=60 * 60 * 30, spawn_counts=SPAWN_COUNTS,
+        spawn_rate=SPAWN_RATE):
+    """Play games with seeds from seed to seed + games - 1, and return the report.
+        Args:
+            games (int): the number of games.
+            workers (int): the number of processes; None means the number of CPUs.
+            seed (int): the seed of the first game.
+            policy (str): key of headless.POLICIES.
+            max_frames (int): games not over in max_frames are stopped.
+            spawn_counts (tuple): passed to Drops.
+            spawn_rate (tuple): passed to Drops.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    config = dict(
+        games=games, workers=workers, seed=seed, policy=policy,
+        max_frames=max_frames, spawn_counts=spawn_counts, spawn_rate=spawn_rate
+    )
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(workers, init_worker, (policy, spawn_counts, spawn_rate)) as pool:
+        args = [(s, max_frames) for s in range(seed, seed + games)]
+        # a game at a time keeps all of the workers busy until the end; games differ in length.
+        results = pool.starmap(play, args, chunksize=1)
+
+    return make_report(results, config, time.perf_counter() - start)
+
+
+def print_summary(report):
+    summary = report['summary']
+
+    for key in ('score', 'merges', 'frames'):
+        s = summary[key]
+        low, high = s['ci95']
+        print(f"{key:>7}: mean={s['mean']:.1f} (95% CI {low:.1f}-{high:.1f}) "
+              f"stdev={s['stdev']:.1f} min={s['min']} max={s['max']}")
+
+    print(f"finished: {summary['finished']}/{report['config']['games']}")
+    print(f"frame time: mean={summary['frame_mean']['mean'] * 1000:.2f}ms "
+          f"p95={summary['frame_p95']['mean'] * 1000:.2f}ms p99={summary['frame_p99']['mean'] * 1000:.2f}ms "
+          f"max={summary['frame_max'] * 1000:.2f}ms")
+    low, high = summary['spawn_latency']['ci95']
+    print(f"spawn latency: mean={summary['spawn_latency']['mean']:.2f}s (95% CI {low:.2f}-{high:.2f}) "
+          f"max queued={summary['max_queued']}")
+    print(f"{summary['frames_per_sec']:.0f} frames/s in {summary['wall_time']:.1f}s")
+
+
+def parse_range(text):
+    low, high = (int(v) for v in text.split(','))
+    return low, high
+
+
+def parse_rate(text):
+    rate, burst = text.split(',')
+    return float(rate), int(burst)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--workers', type=int, help='the number of processes; default is the number of CPUs.')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game; the others follow it.')
+    parser.add_argument('--policy', choices=POLICIES.keys(), default='random')
+    parser.add_argument('--max-frames', type=int, default=60 * 60 * 30)
+    parser.add_argument('--spawn-counts', type=parse_range, nargs=3, metavar='MIN,MAX', default=SPAWN_COUNTS,
+                        help='numbers of drops added at the start, when d2 is addable, and after that.')
+    parser.add_argument('--spawn-rate', type=parse_rate, metavar='RATE,BURST', default=SPAWN_RATE,
+                        help='drops spawned per second, and the maximum drops spawned in a frame.')
+    parser.add_argument('--report', metavar='FILE', help='save the report in FILE as json.')
+    args = parser.parse_args()
+
+    report = run(args.games, args.workers, args.seed, args.policy, args.max_frames, tuple(args.spawn_counts),
+                 args.spawn_rate)
+    print_summary(report)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,65 @@
+"""Compare the python and numpy paths of create_geomnode.
+   Run from the repository root: python -m benchmarks.mesh_build
+"""
+import argparse
+import random
+import time
+
+from colors import Blue
+from create_geomnode import GeomRoot, Sphere, np
+
+
+def geom_bytes(geom_root):
+    geom = geom_root.node().get_geom(0)
+    vdata = bytes(memoryview(geom.get_vertex_data().get_array(0)).cast('B'))
+    indices = bytes(memoryview(geom.get_primitive(0).get_vertices()).cast('B'))
+    return vdata, indices
+
+
+def build_sphere(divnum, use_numpy, shared):
+    GeomRoot.buffers.clear()
+    GeomRoot.use_numpy = use_numpy
+    # the compiled files would be loaded on both paths.
+    GeomRoot.use_compiled = False
+    # Blue.select picks colors at random; pick the same ones on both paths.
+    random.seed(divnum)
+
+    start = time.perf_counter()
+    sphere = Sphere(Blue, divnum=divnum, shared=shared)
+    elapsed = time.perf_counter() - start
+    return elapsed, sphere
+
+
+def best_of(repeat, divnum, use_numpy, shared):
+    results = [build_sphere(divnum, use_numpy, shared) for _ in range(repeat)]
+    elapsed = min(t for t, _ in results)
+    return elapsed, results[-1][1]
+
+
+def main(divnums, repeat, shared=False):
+    if np is None:
+        raise SystemExit('numpy is not installed.')
+
+    print(f'{"divnum":>6} {"vertices":>9} {"python(ms)":>11} {"numpy(ms)":>10} {"speedup":>8} identical')
+
+    for divnum in divnums:
+        py_time, py_sphere = best_of(repeat, divnum, False, shared)
+        np_time, np_sphere = best_of(repeat, divnum, True, shared)
+        vertices = py_sphere.node().get_geom(0).get_vertex_data().get_num_rows()
+        identical = geom_bytes(py_sphere) == geom_bytes(np_sphere)
+
+        print(f'{divnum:>6} {vertices:>9} {py_time * 1000:>11.1f} {np_time * 1000:>10.1f} '
+              f'{py_time / np_time:>7.1f}x {identical}')
+
+    GeomRoot.buffers.clear()
+    GeomRoot.use_numpy = True
+    GeomRoot.use_compiled = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--divnums', type=int, nargs='+', default=[3, 4, 5, 6])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--shared', action='store_true', help='build spheres sharing vertices.')
+    args = parser.parse_args()
+    main(args.divnums, args.repeat, args.shared)
@@ -0,0 +1,343 @@
+"""Time the hot paths of the game in isolation, without a window, and compare the results with a baseline.
+   Run from the repository root:
+       python -m benchmarks.suite --output results.json
+       python -m benchmarks.suite --stress --compare baseline.json
+"""
+import argparse
+import fnmatch
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from typing import NamedTuple, Callable
+
+from panda3d.bullet import BulletWorld, BulletRigidBodyNode, BulletSphereShape
+from panda3d.core import NodePath, PandaNode, Point3, Vec3, BitMask32, PandaSystem
+
+from colors import Blue
+from contacts import ContactSnapshot
+from create_geomnode import GeomRoot, Sphere, Polyhedron, OBJ_DIR, np
+from drops import Convex
+from utils import load_obj
+from visual_effects import VFXHandler
+
+
+class Case(NamedTuple):
+    """Args:
+            run (callable): timed; takes the value returned by setup.
+            setup (callable): not timed; called before each run.
+            items (int): the number of operations in a run.
+    """
+
+    run: Callable
+    setup: Callable = lambda: None
+    items: int = 1
+
+
+class Benchmark(NamedTuple):
+
+    func: Callable
+    sizes: tuple
+    stress_sizes: tuple
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes, stress_sizes=()):
+    """Register func(size), which returns a Case, as a benchmark run with each of the sizes."""
+    def decorator(func):
+        BENCHMARKS[name] = Benchmark(func, sizes, stress_sizes)
+        return func
+    return decorator
+
+
+def headless_game():
+    """Return the headless game shared by the benchmarks needing ShowBase."""
+    from headless import HeadlessGame
+
+    if not hasattr(headless_game, 'game'):
+        game = HeadlessGame()
+        game.setup()
+        headless_game.game = game
+
+    return headless_game.game
+
+
+@benchmark('sphere', sizes=(3, 4), stress_sizes=(5, 6))
+def bench_sphere(divnum):
+    def setup():
+        GeomRoot.buffers.clear()
+        GeomRoot.use_compiled = False
+
+    def run(_):
+        Sphere(Blue, divnum=divnum, shared=True)
+        GeomRoot.use_compiled = True
+
+    return Case(run, setup)
+
+
+@benchmark('polyhedron', sizes=('d4', 'd5', 'd6', 'd7'))
+def bench_polyhedron(stem):
+    def setup():
+        GeomRoot.buffers.clear()
+        GeomRoot.use_compiled = False
+
+    def run(_):
+        Polyhedron(Blue, f'{stem}.obj')
+        GeomRoot.use_compiled = True
+
+    return Case(run, setup)
+
+
+@benchmark('load_obj', sizes=('d4', 'd5', 'd6', 'd7', 'icosahedron'))
+def bench_load_obj(stem):
+    return Case(lambda _: load_obj(f'{OBJ_DIR}/{stem}.obj'))
+
+
+@benchmark('convex_hull', sizes=('d4', 'd5', 'd6', 'd7'))
+def bench_convex_hull(stem):
+    def setup():
+        Convex.shapes.clear()
+        return Polyhedron(Blue, f'{stem}.obj')
+
+    return Case(lambda model: Convex(stem, model, Vec3(1)), setup)
+
+
+def make_pile(n, radius=0.5):
+    """Make a world having n balls touching the next ones in a square grid."""
+    world = BulletWorld()
+    shape = BulletSphereShape(radius)
+    cols = math.ceil(math.sqrt(n))
+    root = NodePath('pile')
+    nodes = []
+
+    for i in range(n):
+        nd = BulletRigidBodyNode(f'ball_{i}')
+        nd.add_shape(shape)
+        nd.set_mass(1)
+        nd.set_tag('stage', 'd1')
+        ball = root.attach_new_node(nd)
+        ball.set_pos(Point3(i % cols, 0, i // cols) * radius * 2)
+        ball.set_collide_mask(BitMask32.bit(1))
+        world.attach(nd)
+        nodes.append(nd)
+
+    world.do_physics(1 / 60, 0)
+    return world, nodes
+
+
+@benchmark('cluster', sizes=(10, 50, 100), stress_sizes=(500,))
+def bench_cluster(n, searches=100):
+    world, nodes = make_pile(n)
+    contacts = ContactSnapshot(world)
+
+    def run(_):
+        for _ in range(searches):
+            contacts.cluster(nodes[0], 'd1')
+
+    return Case(run, items=searches)
+
+
+@benchmark('contacts_build', sizes=(10, 50, 100), stress_sizes=(500,))
+def bench_contacts_build(n):
+    world, _ = make_pile(n)
+    contacts = ContactSnapshot(world)
+    return Case(lambda _: contacts.build())
+
+
+@benchmark('merge', sizes=(10, 30), stress_sizes=(100,))
+def bench_merge(n):
+    """Delete a cluster of n drops and make the next drop at once."""
+    game = headless_game()
+    drops = game.drops
+
+    def setup():
+        game.game_control.initialize()
+        model = drops.drops['d1'].model
+
+        for i in range(n):
+            drops.copy_drop(model, Point3(i % 10 - 5, 0, i // 10 + 1))
+
+        children = drops.get_children()
+        children[0].set_tag('merge', 'd2')
+        drops.is_merging = True
+        return list(children)
+
+    return Case(drops.merge, setup, items=n)
+
+
+@benchmark('height_profile', sizes=(50, 150), stress_sizes=(400,))
+def bench_height_profile(n):
+    """Update the height profile of n moving drops, the worst case of a physics step."""
+    game = headless_game()
+    drops = game.drops
+    heights = game.game_control.heights
+
+    def setup():
+        game.game_control.initialize()
+        model = drops.drops['d1'].model
+
+        for i in range(n):
+            drops.copy_drop(model, Point3(i % 13 - 6, 0, i // 13 + 1))
+
+        heights.clear()
+
+    def run(_):
+        heights.update()
+        return heights.overflow_count()
+
+    return Case(run, setup)
+
+
+@benchmark('spawn_slots', sizes=(10, 50), stress_sizes=(200,))
+def bench_spawn_slots(n, lookups=100):
+    """Find spawn positions among n drops in and around the spawn band."""
+    game = headless_game()
+    drops = game.drops
+    slots = drops.slots
+    radius = drops.radius('d1')
+
+    def setup():
+        game.game_control.initialize()
+        model = drops.drops['d1'].model
+
+        for i in range(n):
+            drops.copy_drop(model, Point3(drops.rng.uniform(-6, 6), 0, drops.rng.uniform(14, 21)))
+
+        slots.clear()
+        slots.update()
+
+    def run(_):
+        for _ in range(lookups):
+            # forget the failed lookup so that each one scans the cells.
+            slots.jam = None
+            slots.find(radius, drops.rng)
+
+    return Case(run, setup, items=lookups)
+
+
+@benchmark('vfx_spawn', sizes=(10, 50), stress_sizes=(200,))
+def bench_vfx_spawn(n):
+    """The python work of the effects through their lifetime: started and removed."""
+    game = headless_game()
+    vfx = VFXHandler()
+    settings = game.drops.drops['d4'].vfx
+    batch = vfx.get_batch(settings.texture)
+    target_root = base.render.attach_new_node('targets')
+
+    def setup():
+        vfx.cleanup()
+        target_root.get_children().detach()
+        return [target_root.attach_new_node(PandaNode(f'target_{i}')).node() for i in range(n)]
+
+    def run(targets):
+        vfx.start(settings, *targets)
+        vfx.remove_effects(batch, list(batch.effects))
+
+    return Case(run, setup, items=n)
+
+
+def measure(case, repeat):
+    times = []
+
+    for _ in range(repeat):
+        state = case.setup()
+        start = time.perf_counter()
+        case.run(state)
+        times.append((time.perf_counter() - start) / case.items)
+
+    return dict(
+        median=statistics.median(times),
+        best=min(times),
+        repeat=repeat,
+        items=case.items
+    )
+
+
+def run_suite(repeat=10, stress=False, only=None):
+    """Return the seconds per operation of each benchmark and size.
+        Args:
+            repeat (int): the number of runs; the median and the best are reported.
+            stress (bool): if True, the stress sizes are run too.
+            only (list): glob patterns of the names, such as 'cluster*'.
+    """
+    results = {}
+
+    for name, bench in BENCHMARKS.items():
+        sizes = bench.sizes + bench.stress_sizes if stress else bench.sizes
+
+        for size in sizes:
+            key = f'{name}[{size}]'
+
+            if only and not any(fnmatch.fnmatch(key, pattern) for pattern in only):
+                continue
+
+            results[key] = measure(bench.func(size), repeat)
+            print(f'{key:<28} {results[key]["best"] * 1000:>10.3f}ms')
+
+    return dict(
+        meta=dict(
+            python=platform.python_version(),
+            panda3d=PandaSystem.get_version_string(),
+            numpy=np is not None,
+            machine=platform.machine(),
+            date=time.strftime('%Y-%m-%dT%H:%M:%S')
+        ),
+        results=results
+    )
+
+
+def compare(current, baseline, threshold=0.25):
+    """Print the ratio of the current best to the baseline best of each benchmark,
+       and return the names slower than the baseline by more than threshold.
+       The best of the runs is compared, not the median, because the other processes and the garbage collector
+       only make runs slower; the median of the same code varied by more than 30% between runs.
+    """
+    regressions = []
+    print(f'{"benchmark":<28} {"baseline(ms)":>12} {"current(ms)":>12} {"ratio":>7}')
+
+    for key, result in current['results'].items():
+        if (base_result := baseline['results'].get(key)) is None:
+            print(f'{key:<28} {"-":>12} {result["best"] * 1000:>12.3f} {"new":>7}')
+            continue
+
+        ratio = result['best'] / base_result['best']
+        mark = ''
+
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            mark = ' REGRESSION'
+
+        print(f'{key:<28} {base_result["best"] * 1000:>12.3f} {result["best"] * 1000:>12.3f} '
+              f'{ratio:>6.2f}x{mark}')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--stress', action='store_true', help='run the stress sizes too.')
+    parser.add_argument('--only', nargs='+', metavar='PATTERN', help="run the benchmarks matching 'cluster*' etc.")
+    parser.add_argument('--output', metavar='FILE', help='save the results in FILE as json.')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a saved baseline.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown of the best time regarded as a regression; 0.25 means 25%%.')
+    args = parser.parse_args()
+
+    results = run_suite(args.repeat, args.stress, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if regressions := compare(results, baseline, args.threshold):
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
@@ -0,0 +1,88 @@
+from collections import defaultdict, deque
+
+
+class ContactSnapshot:
+    """Contacts of the bullet world collected from the dispatcher's manifolds,
+       at most once a physics step and only when they are read.
+       The drops around a deleted one are woken up from the snapshot instead of running a bullet query;
+       click clusters run contact_test, see cluster.
+        Args:
+            world (BulletWorld)
+    """
+
+    def __init__(self, world):
+        self.world = world
+        # dicts rather than sets to visit the contacts in the same order in every run.
+        self.adjacency = defaultdict(dict)
+        self.stale = True
+
+        self.builds = 0
+        self.reads = 0
+        self.contact_tests = 0
+
+    def invalidate(self):
+        self.stale = True
+
+    def build(self):
+        self.adjacency.clear()
+
+        for manifold in self.world.get_manifolds():
+            nd0 = manifold.get_node0()
+            nd1 = manifold.get_node1()
+
+            if manifold.get_num_manifold_points():
+                self.adjacency[nd0][nd1] = None
+                self.adjacency[nd1][nd0] = None
+
+        self.stale = False
+        self.builds += 1
+
+    def update(self):
+        """Call after every world.do_physics; the snapshot is rebuilt on the next read."""
+        self.invalidate()
+
+    def refresh(self):
+        if self.stale:
+            self.build()
+
+    def contacts(self, nd):
+        self.refresh()
+        self.reads += 1
+        return self.adjacency.get(nd, ())
+
+    def cluster(self, nd, tag):
+        """Return the nodes of the same stage contacting with each other, starting from nd.
+           The manifolds are computed before the step moves the bodies, and many touching pairs of awake drops
+           have no points or no manifold, so clusters are found by contact_test against the current positions.
+            Args:
+                nd: BulletRigidBodyNode
+                tag (str): stage
+        """
+        found = [nd]
+        visited = {nd}
+        que = deque(found)
+
+        while que:
+            self.contact_tests += 1
+
+            cur_nd = que.popleft()
+
+            for con in self.world.contact_test(cur_nd, use_filter=True).get_contacts():
+                # either node of a contact can be the one tested.
+                con_nd = con.get_node0() if con.get_node1() == cur_nd else con.get_node1()
+
+                if con_nd not in visited and con_nd.get_tag('stage') == tag \
+                        and not con_nd.has_tag('effecting'):
+                    visited.add(con_nd)
+                    found.append(con_nd)
+                    que.append(con_nd)
+
+        return found
+
+    def stats(self):
+        return dict(builds=self.builds, reads=self.reads, contact_tests=self.contact_tests)
+
+    def reset_stats(self):
+        self.builds = 0
+        self.reads = 0
+        self.contact_tests = 0
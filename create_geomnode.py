@@ -1,19 +1,61 @@
 import array
-import functools
+import os
+from itertools import chain
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from panda3d.core import Vec3, Point3
 from panda3d.core import NodePath
 from panda3d.core import Geom, GeomNode, GeomTriangles
 from panda3d.core import GeomVertexFormat, GeomVertexData, GeomVertexArrayFormat
 
+from mesh_file import COMPILED_DIR, read_mesh
 from utils import load_obj
 
 
 OBJ_DIR = 'objs'
 
 
+def normalize_rows(vectors):
+    """Normalize float32 vectors in the same way as Vec3.normalized.
+        Args:
+            vectors (numpy.ndarray): float32 array of shape (n, 3)
+    """
+    x, y, z = vectors.T
+    l2 = x * x + (y * y + z * z)
+    normalized = vectors.copy()
+
+    if (scale := (l2 != 1) & (l2 != 0)).any():
+        recip = np.float32(1) / np.sqrt(l2[scale])
+        normalized[scale] *= recip[:, None]
+
+    normalized[l2 == 0] = 0
+    return normalized
+
+
+class GeomBuffers(NamedTuple):
+
+    vdata_values: array.array
+    prim_indices: array.array
+    vertex_count: int
+    color_slots: array.array
+    slot_count: int
+
+
 class GeomRoot(NodePath):
 
+    # vertex and index buffers shared by the instances having the same cache key.
+    buffers = {}
+    palette = ()
+    # build buffers by create_arrays instead of create_vertices if the subclass has it.
+    use_numpy = np is not None
+    # load buffers from the files compiled by mesh_file.py if they are up to date.
+    use_compiled = True
+
     def __init__(self, name, tex=True):
         geomnode = self.create_geomnode(name, tex)
         super().__init__(geomnode)
@@ -37,22 +79,95 @@ class GeomRoot(NodePath):
         fmt = GeomVertexFormat.register_format(arr_format)
         return fmt
 
+    def cache_key(self):
+        """Return a hashable key to reuse vertex and index buffers, or None not to cache them.
+           Only the colors of the vertices are rewritten when buffers are reused.
+        """
+        return None
+
+    def compiled_path(self):
+        """Return the path of the compiled file of the buffers, or None if they cannot be compiled."""
+        return None
+
+    def load_compiled(self):
+        if self.use_compiled and (path := self.compiled_path()) is not None:
+            return read_mesh(path, self.obj_file)
+
+    def select_palette(self, n):
+        return self.colors.select(n)
+
+    def build_buffers(self):
+        self.color_slots = array.array('B', [])
+
+        if self.use_numpy and hasattr(self, 'create_arrays'):
+            vdata_values, prim_indices, vertex_count = self.create_arrays()
+        else:
+            vdata_values = array.array('f', [])
+            prim_indices = array.array('I', [])
+            vertex_count = self.create_vertices(vdata_values, prim_indices)
+
+            if vertex_count <= 0xffff:
+                prim_indices = array.array('H', prim_indices)
+
+        return GeomBuffers(
+            vdata_values, prim_indices, vertex_count, self.color_slots, len(self.palette))
+
+    def index_array(self, indices, vertex_count):
+        dtype = np.uint16 if vertex_count <= 0xffff else np.uint32
+        return np.ascontiguousarray(indices, dtype=dtype).ravel()
+
+    def get_buffers(self):
+        if (key := self.cache_key()) is None:
+            return self.build_buffers(), None
+
+        if (buffers := self.buffers.get(key)) is None:
+            if (buffers := self.load_compiled()) is None:
+                buffers = self.buffers[key] = self.build_buffers()
+                return buffers, None
+
+            self.buffers[key] = buffers
+
+        self.palette = self.select_palette(buffers.slot_count)
+        return buffers, self.palette
+
+    def recolor(self, vdata_mem, fmt, color_slots, palette):
+        arr_format = fmt.get_array(0)
+        stride = arr_format.get_stride() // 4
+        start = arr_format.get_column('color').get_start() // 4
+
+        if np is not None:
+            colors = np.array([tuple(color) for color in palette], dtype=np.float32)
+            rows = np.frombuffer(vdata_mem, dtype=np.float32).reshape(-1, stride)
+            rows[:, start:start + 4] = colors[np.asarray(color_slots)]
+            return
+
+        colors = [array.array('f', color) for color in palette]
+
+        for i, slot in enumerate(color_slots):
+            pos = i * stride + start
+            vdata_mem[pos:pos + 4] = colors[slot]
+
     def create_geomnode(self, name, tex):
         fmt = self.create_format(tex)
-        vdata_values = array.array('f', [])
-        prim_indices = array.array('H', [])
-
-        vertex_count = self.create_vertices(vdata_values, prim_indices)
+        (vdata_values, prim_indices, vertex_count, color_slots, _), palette = self.get_buffers()
 
         vdata = GeomVertexData(name, fmt, Geom.UHStatic)
         vdata.unclean_set_num_rows(vertex_count)
         vdata_mem = memoryview(vdata.modify_array(0)).cast('B').cast('f')
         vdata_mem[:] = vdata_values
 
+        if palette:
+            self.recolor(vdata_mem, fmt, color_slots, palette)
+
         prim = GeomTriangles(Geom.UHStatic)
+        index_format = memoryview(prim_indices).format
+
+        if index_format == 'I':
+            prim.set_index_type(Geom.NT_uint32)
+
         prim_array = prim.modify_vertices()
         prim_array.unclean_set_num_rows(len(prim_indices))
-        prim_mem = memoryview(prim_array).cast('B').cast('H')
+        prim_mem = memoryview(prim_array).cast('B').cast(index_format)
         prim_mem[:] = prim_indices
 
         node = GeomNode('geomnode')
@@ -137,6 +252,58 @@ class Cube(GeomRoot):
 
         return vertex_count
 
+    def create_arrays(self):
+        segs = (self.segs_w, self.segs_d, self.segs_h)
+        dims = (self.w, self.d, self.h)
+        segs_u = self.segs_w * 2 + self.segs_d * 2
+        offset_u = 0
+        vertex_count = 0
+        vdata_values = []
+        prim_indices = []
+
+        side_idxes = [
+            (2, 0, 1, 1, False),     # top
+            (1, 0, 2, -1, False),    # front
+            (0, 1, 2, 1, False),     # right
+            (1, 0, 2, 1, True),      # back
+            (0, 1, 2, -1, True),     # left
+            (2, 0, 1, -1, False),    # bottom
+        ]
+
+        for i0, i1, i2, n, reverse in side_idxes:
+            segs1 = segs[i1]
+            segs2 = segs[i2]
+            j, k = (arr.ravel() for arr in np.meshgrid(
+                np.arange(segs1 + 1), np.arange(segs2 + 1), indexing='ij'))
+
+            rows = np.zeros((len(j), 12))
+            rows[:, i0] = dims[i0] * 0.5 * n
+            rows[:, i1] = dims[i1] * -0.5 + j / segs1 * dims[i1]
+            rows[:, i2] = dims[i2] * -0.5 + k / segs2 * dims[i2]
+            rows[:, 3:7] = self.color
+            rows[:, 7 + i0] = n
+
+            if i0 == 2:
+                rows[:, 10] = j / segs1
+            else:
+                rows[:, 10] = (segs1 - j + offset_u) / segs_u if reverse else (j + offset_u) / segs_u
+
+            rows[:, 11] = k / segs2
+            vdata_values.append(rows)
+
+            j, k = (arr.ravel() for arr in np.meshgrid(
+                np.arange(1, segs1 + 1), np.arange(segs2), indexing='ij'))
+            idx = vertex_count + j * (segs2 + 1) + k
+            prim_indices.append(np.stack(
+                [idx, idx - segs2 - 1, idx - segs2, idx, idx - segs2, idx + 1], axis=1))
+
+            vertex_count += (segs1 + 1) * (segs2 + 1)
+            offset_u += segs2
+
+        vdata_values = np.concatenate(vdata_values).astype(np.float32).ravel()
+        prim_indices = self.index_array(np.concatenate(prim_indices), vertex_count)
+        return vdata_values, prim_indices, vertex_count
+
 
 class RightTriangularPrism(GeomRoot):
     """Create a geom node of right triangular prism.
@@ -241,42 +408,6 @@ class RightTriangularPrism(GeomRoot):
         return vertex_count
 
 
-class TextureAtlasNode(GeomRoot):
-
-    def __init__(self, max_u, start_v):
-        self.max_u = max_u
-        self.start_v = start_v
-        self.color = (1, 1, 1, 1)
-        super().__init__('texture_atlas')
-
-    def create_vertices(self, vdata_values, prim_indices):
-        vertices = [
-            (-0.5, 0, 0.5),
-            (-0.5, 0, -0.5),
-            (0.5, 0, 0.5),
-            (0.5, 0, -0.5),
-        ]
-        # order is important
-        uvs = [
-            (0, 1),
-            (0, self.start_v),
-            (self.max_u, 1),
-            (self.max_u, self.start_v),
-        ]
-
-        for i, (vertex, uv) in enumerate(zip(vertices, uvs)):
-            vdata_values.extend(vertex)
-            vdata_values.extend(self.color)
-            vdata_values.extend(Vec3(vertex).normalized())
-            vdata_values.extend(uv)
-
-        idx = 2
-        prim_indices.extend((idx, idx - 2, idx - 1))
-        prim_indices.extend((idx, idx - 1, idx + 1))
-
-        return len(vertices)
-
-
 class Sphere(GeomRoot):
     """Create a geom node of sphere.
         Arges:
@@ -285,12 +416,15 @@ class Sphere(GeomRoot):
                 0: one color
                 1: dot; two color
                 2: one line; two color
+            shared (bool): if True, each vertex is emitted once and shared by the neighbouring faces;
+                vertices are split only along the color boundaries.
     """
 
-    def __init__(self, colors, divnum=3, pattern=0):
+    def __init__(self, colors, divnum=3, pattern=0, shared=False):
         self.obj_file = f'{OBJ_DIR}/icosahedron.obj'
         self.divnum = divnum
         self.pattern = pattern
+        self.shared = shared
         self.colors = colors
         super().__init__('sphere', False)
 
@@ -317,43 +451,94 @@ class Sphere(GeomRoot):
                 yield from self.subdivide(face, divnum + 1)
             yield from self.subdivide(midpoints, divnum + 1)
 
-    def get_vertex_color(self, indexer, colors, pts):
-        idx = indexer(pts)
-        return colors[idx]
+    def subdivide_indices(self, face, positions, midpoints, divnum=0):
+        """Subdivide a face in the same order as subdivide, but with the indices of positions.
+           The midpoint of each edge is appended to positions only once.
+            Args:
+                face (list): indices of positions; having 3 elements.
+                positions (list): list of Vec3
+                midpoints (dict): the index of the midpoint of each edge.
+        """
+        if divnum == self.divnum:
+            yield face
+        else:
+            mid_face = []
 
-    def create_vertices(self, vdata_values, prim_indices):
-        vertices, faces = load_obj(self.obj_file)
+            for i, idx1 in enumerate(face):
+                idx2 = face[i + 1 if i < len(face) - 1 else 0]
+                edge = (idx1, idx2) if idx1 < idx2 else (idx2, idx1)
 
+                if (mid_idx := midpoints.get(edge)) is None:
+                    mid_idx = midpoints[edge] = len(positions)
+                    positions.append((positions[idx1] + positions[idx2]) / 2)
+
+                mid_face.append(mid_idx)
+
+            for i, idx in enumerate(face):
+                j = len(face) - 1 if i == 0 else i - 1
+                yield from self.subdivide_indices([idx, mid_face[i], mid_face[j]], positions, midpoints, divnum + 1)
+            yield from self.subdivide_indices(mid_face, positions, midpoints, divnum + 1)
+
+    def cache_key(self):
+        return (type(self), self.obj_file, self.divnum, self.pattern, self.shared)
+
+    def compiled_path(self):
+        shared = '_shared' if self.shared else ''
+        return f'{COMPILED_DIR}/sphere_{self.divnum}_{self.pattern}{shared}.mesh'
+
+    def get_color_slot(self, vertices):
         match self.pattern:
             case 0:
-                get_vertex_color = functools.partial(
-                    self.get_vertex_color,
-                    lambda vertices: 0,
-                    self.colors.select(1)
-                )
+                return 0
             case 1:
-                get_vertex_color = functools.partial(
-                    self.get_vertex_color,
-                    lambda vertices: 0 if any(not (v.z or v.x) or not (v.z or v.y) or not (v.x or v.y) for v in vertices) else 1,
-                    self.colors.select(2)
-                )
+                return 0 if any(not (v.z or v.x) or not (v.z or v.y) or not (v.x or v.y) for v in vertices) else 1
             case 2:
-                get_vertex_color = functools.partial(
-                    self.get_vertex_color,
-                    lambda vertices: 0 if any(v.z == 0 for v in vertices) else 1,
-                    self.colors.select(2)
-                )
+                return 0 if any(v.z == 0 for v in vertices) else 1
+
+    def create_shared_vertices(self, vdata_values, prim_indices):
+        vertices, faces = load_obj(self.obj_file)
+        self.palette = self.select_palette(1 if self.pattern == 0 else 2)
+
+        positions = [Vec3(vertex) for vertex in vertices]
+        midpoints = {}
+        emitted = {}
+
+        for face in faces:
+            for subdiv_face in self.subdivide_indices(list(face), positions, midpoints):
+                slot = self.get_color_slot([positions[idx] for idx in subdiv_face])
+
+                for idx in subdiv_face:
+                    if (vert_idx := emitted.get((idx, slot))) is None:
+                        vert_idx = emitted[(idx, slot)] = len(emitted)
+                        normal = positions[idx].normalized()
+                        vdata_values.extend(normal)
+                        vdata_values.extend(self.palette[slot])
+                        vdata_values.extend(normal)
+                        self.color_slots.append(slot)
+
+                    prim_indices.append(vert_idx)
+
+        return len(emitted)
+
+    def create_vertices(self, vdata_values, prim_indices):
+        if self.shared:
+            return self.create_shared_vertices(vdata_values, prim_indices)
+
+        vertices, faces = load_obj(self.obj_file)
+        self.palette = self.select_palette(1 if self.pattern == 0 else 2)
 
         start = 0
         for face in faces:
             face_verts = [Vec3(vertices[n]) for n in face]
             for subdiv_face in self.subdivide(face_verts):
-                color = get_vertex_color(subdiv_face)
+                slot = self.get_color_slot(subdiv_face)
+                color = self.palette[slot]
                 for vert in subdiv_face:
                     normal = vert.normalized()
                     vdata_values.extend(normal)
                     vdata_values.extend(color)
                     vdata_values.extend(normal)
+                    self.color_slots.append(slot)
 
                 indices = (start, start + 1, start + 2)
                 prim_indices.extend(indices)
@@ -361,6 +546,100 @@ class Sphere(GeomRoot):
 
         return 4 ** self.divnum * 20 * 3
 
+    def subdivide_arrays(self, faces):
+        """faces (numpy.ndarray): float32 array of shape (n, 3, 3)
+           Return the subdivided faces in the same order as subdivide.
+        """
+        v0, v1, v2 = faces[:, 0], faces[:, 1], faces[:, 2]
+        m0 = (v0 + v1) * np.float32(0.5)
+        m1 = (v1 + v2) * np.float32(0.5)
+        m2 = (v2 + v0) * np.float32(0.5)
+
+        subdiv_faces = np.stack([
+            np.stack([v0, m0, m2], axis=1),
+            np.stack([v1, m1, m0], axis=1),
+            np.stack([v2, m2, m1], axis=1),
+            np.stack([m0, m1, m2], axis=1),
+        ], axis=1)
+
+        return subdiv_faces.reshape(-1, 3, 3)
+
+    def get_color_slots(self, faces):
+        x, y, z = faces[..., 0] == 0, faces[..., 1] == 0, faces[..., 2] == 0
+
+        match self.pattern:
+            case 0:
+                slots = np.zeros(len(faces), dtype=bool)
+            case 1:
+                slots = ~((z & x) | (z & y) | (x & y)).any(axis=1)
+            case 2:
+                slots = ~z.any(axis=1)
+
+        return slots.astype(np.uint8)
+
+    def subdivide_index_arrays(self, positions, faces):
+        """Subdivide faces given as indices of positions, computing each edge midpoint once.
+            Args:
+                positions (numpy.ndarray): float32 array of shape (n, 3)
+                faces (numpy.ndarray): int array of shape (m, 3)
+        """
+        edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+        uniq_edges, inverse = np.unique(edges, axis=0, return_inverse=True)
+        midpoints = (positions[uniq_edges[:, 0]] + positions[uniq_edges[:, 1]]) * np.float32(0.5)
+
+        m0, m1, m2 = (len(positions) + inverse.reshape(-1, 3)).T
+        v0, v1, v2 = faces.T
+        subdiv_faces = np.stack([v0, m0, m2, v1, m1, m0, v2, m2, m1, m0, m1, m2], axis=1)
+
+        return np.concatenate([positions, midpoints]), subdiv_faces.reshape(-1, 3)
+
+    def create_shared_arrays(self):
+        vertices, faces = load_obj(self.obj_file)
+        self.palette = self.select_palette(1 if self.pattern == 0 else 2)
+
+        positions = np.array(vertices, dtype=np.float32)
+        subdiv_faces = np.array(faces)
+        for _ in range(self.divnum):
+            positions, subdiv_faces = self.subdivide_index_arrays(positions, subdiv_faces)
+
+        slots = np.repeat(self.get_color_slots(positions[subdiv_faces]), 3)
+        # emit each pair of position and color slot once, in order of first appearance.
+        keys = subdiv_faces.ravel() * len(self.palette) + slots
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        corners = first[order]
+        self.color_slots = slots[corners]
+        normals = normalize_rows(positions[subdiv_faces.ravel()[corners]])
+        colors = np.array([tuple(color) for color in self.palette], dtype=np.float32)
+
+        vdata_values = np.hstack([normals, colors[self.color_slots], normals]).ravel()
+        vertex_count = len(normals)
+        prim_indices = self.index_array(rank[inverse.ravel()], vertex_count)
+        return vdata_values, prim_indices, vertex_count
+
+    def create_arrays(self):
+        if self.shared:
+            return self.create_shared_arrays()
+
+        vertices, faces = load_obj(self.obj_file)
+        self.palette = self.select_palette(1 if self.pattern == 0 else 2)
+
+        subdiv_faces = np.array(vertices, dtype=np.float32)[np.array(faces)]
+        for _ in range(self.divnum):
+            subdiv_faces = self.subdivide_arrays(subdiv_faces)
+
+        self.color_slots = np.repeat(self.get_color_slots(subdiv_faces), 3)
+        normals = normalize_rows(subdiv_faces.reshape(-1, 3))
+        colors = np.array([tuple(color) for color in self.palette], dtype=np.float32)
+
+        vdata_values = np.hstack([normals, colors[self.color_slots], normals]).ravel()
+        vertex_count = len(normals)
+        prim_indices = self.index_array(np.arange(vertex_count), vertex_count)
+        return vdata_values, prim_indices, vertex_count
+
 
 class Polyhedron(GeomRoot):
 
@@ -369,6 +648,13 @@ class Polyhedron(GeomRoot):
         self.colors = colors
         super().__init__('polyhedron', False)
 
+    def cache_key(self):
+        return (type(self), self.obj_file)
+
+    def compiled_path(self):
+        stem = os.path.splitext(os.path.basename(self.obj_file))[0]
+        return f'{COMPILED_DIR}/{stem}.mesh'
+
     def triangle(self, start):
         return (start, start + 1, start + 2)
 
@@ -395,14 +681,15 @@ class Polyhedron(GeomRoot):
     def create_vertices(self, vdata_values, prim_indices):
         vertices, faces = load_obj(self.obj_file)
         nums = set(len(face) for face in faces)
-        colors = self.colors.select(len(nums))
-        face_color = {n: colors[i] for i, n in enumerate(nums)}
+        self.palette = self.select_palette(len(nums))
+        face_slot = {n: i for i, n in enumerate(nums)}
 
         start = 0
 
         for face in faces:
             cnt = len(face)
-            color = face_color[len(face)]
+            slot = face_slot[cnt]
+            color = self.palette[slot]
             for idx in face:
                 vertex = Vec3(vertices[idx])
                 normal = vertex.normalized()
@@ -410,9 +697,43 @@ class Polyhedron(GeomRoot):
                 vdata_values.extend(vertex)
                 vdata_values.extend(color)
                 vdata_values.extend(normal)
+                self.color_slots.append(slot)
 
             for indices in self.get_indices(start, cnt):
                 prim_indices.extend(indices)
             start += cnt
 
-        return sum(len(face) for face in faces)
\ No newline at end of file
+        return sum(len(face) for face in faces)
+
+    def create_arrays(self):
+        vertices, faces = load_obj(self.obj_file)
+        nums = set(len(face) for face in faces)
+        self.palette = self.select_palette(len(nums))
+        face_slot = {n: i for i, n in enumerate(nums)}
+
+        sizes = np.array([len(face) for face in faces])
+        positions = np.array(vertices, dtype=np.float32)[np.fromiter(chain.from_iterable(faces), dtype=np.intp)]
+        self.color_slots = np.repeat(np.array([face_slot[n] for n in sizes.tolist()], dtype=np.uint8), sizes)
+        colors = np.array([tuple(color) for color in self.palette], dtype=np.float32)
+
+        vdata_values = np.hstack([positions, colors[self.color_slots], normalize_rows(positions)]).ravel()
+        vertex_count = len(positions)
+
+        # triangles fanning out from the first vertex of each face, except squares.
+        tri_cnts = sizes - 2
+        face_sizes = np.repeat(sizes, tri_cnts)
+        start = np.repeat(np.cumsum(sizes) - sizes, tri_cnts)
+        i = np.arange(tri_cnts.sum()) - np.repeat(np.cumsum(tri_cnts) - tri_cnts, tri_cnts) + 2
+
+        first = (i == 2)[:, None]
+        indices = np.where(
+            first, np.stack([start, start + 1, start + 2], axis=1), np.stack([start + i - 1, start, start + i], axis=1))
+
+        square = (face_sizes == 4)[:, None]
+        indices = np.where(
+            square & first, np.stack([start + 2, start + 1, start], axis=1), indices)
+        indices = np.where(
+            square & ~first, np.stack([start, start + 3, start + 2], axis=1), indices)
+
+        prim_indices = self.index_array(indices, vertex_count)
+        return vdata_values, prim_indices, vertex_count
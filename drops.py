@@ -1,19 +1,46 @@
 import random
-from collections import deque
+from collections import deque, defaultdict
 
 from direct.interval.IntervalGlobal import ProjectileInterval, Parallel, Sequence, Func, Wait
+from direct.showbase.DirectObject import DirectObject
 from panda3d.bullet import BulletRigidBodyNode
 from panda3d.bullet import BulletConvexHullShape, BulletSphereShape
 from panda3d.core import NodePath, PandaNode
 from panda3d.core import Vec3, Point3, BitMask32
 from panda3d.core import TransparencyAttrib
-from panda3d.core import TransformState
 
+from assets import assets
 from colors import theme_colors
 from create_geomnode import Sphere, Polyhedron
+from profiler import profiler
+from spawn_scheduler import SpawnScheduler
+from spawn_slots import SpawnSlots
 from visual_effects import VFXHandler, TextureAtlas, VFXSetting
 
 
+# the number of drops of each stage made before a game starts.
+POOL_SIZES = dict(d1=40, d2=20, d3=10, d4=6, d5=4, d6=2, d7=2, d8=1)
+
+# (min, max) numbers of drops added at the start, when d2 becomes addable, and after that.
+SPAWN_COUNTS = ((30, 40), (20, 30), (10, 20))
+
+# (drops per second, the maximum drops in a frame) at which the queued drops are spawned.
+SPAWN_RATE = (60, 3)
+
+# (linear, angular) velocities under which the drops of each stage fall asleep;
+# bigger drops move their surfaces faster at the same angular velocity.
+SLEEP_THRESHOLDS = dict(
+    d1=(0.4, 0.8),
+    d2=(0.4, 0.8),
+    d3=(0.5, 0.7),
+    d4=(0.5, 0.6),
+    d5=(0.6, 0.5),
+    d6=(0.6, 0.5),
+    d7=(0.7, 0.4),
+    d8=(0.7, 0.4)
+)
+
+
 class Models(NodePath):
 
     def __init__(self, tag, model, scale):
@@ -28,6 +55,11 @@ class Models(NodePath):
         nd.set_linear_factor(Vec3(1, 1, 1))
         nd.set_kinematic(True)
 
+    def set_sleep_thresholds(self, linear, angular):
+        self.node().set_deactivation_enabled(True)
+        self.node().set_linear_sleep_threshold(linear)
+        self.node().set_angular_sleep_threshold(angular)
+
 
 class Smiley(Models):
 
@@ -36,7 +68,8 @@ class Smiley(Models):
 
         end, tip = model.get_tight_bounds()
         size = tip - end
-        shape = BulletSphereShape(size.z / 2)
+        self.rad = size.z / 2
+        shape = BulletSphereShape(self.rad)
         self.node().add_shape(shape)
         self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2))
         self.node().set_mass(1)
@@ -44,20 +77,36 @@ class Smiley(Models):
 
 class Convex(Models):
 
+    # convex hull shapes shared by the models having the same geometry and scale.
+    shapes = {}
+
     def __init__(self, tag, model, scale):
         super().__init__(tag, model, scale)
-
-        shape = BulletConvexHullShape()
-        shape.add_geom(model.node().get_geom(0))
+        shape = self.get_shape(model, scale)
         self.node().add_shape(shape)
-        # 1: other drops and game board, 2: click raycast, 3: gameover judge
-        self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(3))
+        # 1: other drops and game board, 2: click raycast
+        self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2))
         self.node().set_mass(0.5)
         self.set_transparency(TransparencyAttrib.MAlpha)
         self.rad = self.get_bounds().get_radius()
         self.node().set_ccd_motion_threshold(1e-7)
         self.node().set_ccd_swept_sphere_radius(self.rad)
 
+    def get_shape(self, model, scale):
+        if (geom_key := model.cache_key()) is not None:
+            key = (geom_key, tuple(scale))
+
+            if (shape := self.shapes.get(key)) is not None:
+                return shape
+
+        shape = BulletConvexHullShape()
+        shape.add_geom(model.node().get_geom(0))
+
+        if geom_key is not None:
+            self.shapes[key] = shape
+
+        return shape
+
 
 class Drop:
 
@@ -74,27 +123,114 @@ class Drop:
 
     def set_model(self, geomnode):
         self.model = Convex(self.stage, geomnode, self.scale)
+        self.model.set_sleep_thresholds(*SLEEP_THRESHOLDS[self.stage])
+
+
+class DropPool:
+    """Keep detached copies of the drop models to reuse them, instead of copy_to and remove_node.
+        Args:
+            parent (NodePath): the node that the drops are attached to.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.free = defaultdict(list)
+        self.hits = 0
+        self.misses = 0
+
+    def warm_up(self, model, size):
+        free = self.free[model.get_tag('stage')]
+
+        while len(free) < size:
+            np = model.copy_to(self.parent)
+            np.detach_node()
+            free.append(np)
+
+    def acquire(self, model):
+        if free := self.free[model.get_tag('stage')]:
+            self.hits += 1
+            np = free.pop()
+            np.reparent_to(self.parent)
+            return np
+
+        self.misses += 1
+        return model.copy_to(self.parent)
+
+    def release(self, np):
+        nd = np.node()
+
+        for tag in ('merge', 'effecting', 'first_smiley'):
+            nd.clear_tag(tag)
+
+        nd.set_kinematic(False)
+        nd.set_linear_factor(Vec3(1, 0, 1))
+        nd.set_linear_velocity(Vec3(0, 0, 0))
+        nd.set_angular_velocity(Vec3(0, 0, 0))
+        nd.clear_forces()
+        np.set_hpr(0, 0, 0)
+        np.clear_color_scale()
+        np.detach_node()
+        self.free[nd.get_tag('stage')].append(np)
+
+    def clear(self, *stages):
+        for stage in stages:
+            for np in self.free.pop(stage, []):
+                np.remove_node()
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            free={stage: len(free) for stage, free in self.free.items()}
+        )
 
 
-class Drops(NodePath):
+class Drops(NodePath, DirectObject):
 
-    def __init__(self, world, game_board):
+    def __init__(self, world, game_board, contacts, pool_sizes=POOL_SIZES, vfx_handler=VFXHandler,
+                 spawn_counts=SPAWN_COUNTS, spawn_rate=SPAWN_RATE):
         super().__init__(PandaNode('drops'))
         self.world = world
         self.game_board = game_board
+        self.contacts = contacts
+        self.pool = DropPool(self)
+        self.pool_sizes = pool_sizes
+        self.spawn_counts = spawn_counts
 
-        self.smiley_q = deque()
         self.drops_q = deque()
-        self.vfx_q = deque()
-        self.vfx = VFXHandler(self.vfx_q)
-        self.smiley = Smiley('d8', base.loader.loadModel('smiley'))
+        self.slots = SpawnSlots(self, game_board.cabinet.dims)
+        self.spawner = SpawnScheduler(self, *spawn_rate)
+        self.vfx = vfx_handler()
+        self.smiley = Smiley('d8', assets.get_model('smiley'))
+        self.smiley.set_sleep_thresholds(*SLEEP_THRESHOLDS['d8'])
         self.setup_drops()
 
+        # incremented whenever a drop is added or deleted.
+        self.revision = 0
+        # the radius of the drops of each stage.
+        self.radii = {}
+        self.active_count = 0
+        self.sleeping_count = 0
+
+        # InstancedRenderer drawing the drops, if instanced rendering is enabled.
+        self.instances = None
+
+        self.rng = random.Random()
         self.colors = theme_colors[:]
-        random.shuffle(self.colors)
+        self.rng.shuffle(self.colors)
         self.color_idx = 0
         self.jump_seq = None
 
+        # sent by the vfx handler when the effects no longer hide the exploding drops.
+        self.accept('targets-removed', self.merge)
+
+    def seed(self, seed):
+        """Make the theme colors and the drops added reproducible; call before initialize."""
+        self.rng.seed(seed)
+        self.colors = theme_colors[:]
+        self.rng.shuffle(self.colors)
+        self.color_idx = 0
+
     def setup_drops(self):
         vfx_1 = VFXSetting(TextureAtlas('boom_fire.png'), scale=2.0, tgt_remove_row=2)
         vfx_2 = VFXSetting(TextureAtlas('blast2.png'), scale=2.2, vfx_end_row=5, tgt_remove_row=2)
@@ -124,22 +260,76 @@ class Drops(NodePath):
             self.color_idx = 0
 
         geom_nodes = dict(
-            d1=Sphere(colors),
-            d2=Sphere(colors, pattern=1),
-            d3=Sphere(colors, pattern=2),
+            d1=Sphere(colors, shared=True),
+            d2=Sphere(colors, pattern=1, shared=True),
+            d3=Sphere(colors, pattern=2, shared=True),
             d4=Polyhedron(colors, 'd4.obj'),   # icosidodecahedron
             d5=Polyhedron(colors, 'd5.obj'),   # Parabiaugmented truncated dodecahedron
             d6=Polyhedron(colors, 'd6.obj'),   # Truncated icosidodecahedron
             d7=Polyhedron(colors, 'd7.obj')    # Truncated icosahedron
         )
 
+        # the pooled drops have the geometry of the previous theme.
+        self.pool.clear(*geom_nodes.keys())
+
         for key, geom_node in geom_nodes.items():
             drop = self.drops[key]
             drop.set_model(geom_node)
 
+        if self.instances is not None:
+            self.instances.set_models({key: self.drops[key].model for key in geom_nodes})
+
     def delete(self, np):
+        # the drops on np would float in the air if they kept sleeping.
+        self.wake_neighbours(np.node())
         self.world.remove(np.node())
-        np.remove_node()
+        self.pool.release(np)
+        self.revision += 1
+
+    def wake_neighbours(self, nd):
+        """Bullet wakes up the whole island once one of its bodies is woken up."""
+        for con_nd in self.contacts.contacts(nd):
+            if con_nd.get_tag('stage') and not con_nd.is_active():
+                con_nd.set_active(True)
+
+    def radius(self, stage):
+        """Return the radius of the drops of a stage, taken from the physics model,
+           because the geometry is stashed when the drops are drawn by instancing.
+        """
+        if (rad := self.radii.get(stage)) is None:
+            model = self.drops[stage].model
+            # rad is in the model's own space, without its scale.
+            rad = self.radii[stage] = model.rad * model.get_sx()
+
+        return rad
+
+    def update_index(self, index):
+        """Remove the deleted drops from index, and place the drops moved since its last update in it.
+           The sleeping drops are not moved, and are skipped unless they are new.
+            Args:
+                index: having entries keyed by the nodes of the drops, revision, place(np) and remove(nd).
+        """
+        if index.revision != self.revision:
+            index.revision = self.revision
+            current = {np.node() for np in self.get_children()}
+
+            for nd in [nd for nd in index.entries if nd not in current]:
+                index.remove(nd)
+
+        for np in self.get_children():
+            nd = np.node()
+
+            if nd.is_active() or nd not in index.entries:
+                index.place(np)
+
+    def update_activity(self):
+        """Count the active and sleeping drops; call after every physics step."""
+        active = sum(1 for np in self.get_children() if np.node().is_active())
+        self.active_count = active
+        self.sleeping_count = self.get_num_children() - active
+
+    def levels(self):
+        return dict(active=self.active_count, sleeping=self.sleeping_count)
 
     def cleanup(self):
         for np in self.get_children():
@@ -149,79 +339,53 @@ class Drops(NodePath):
             self.jump_seq.pause()
             self.jump_seq = None
 
-        self.smiley_q.clear()
-        self.drops_q.clear()
-        self.vfx_q.clear()
+        self.spawner.clear()
+        self.slots.clear()
         self.vfx.cleanup()
 
-    def initialize(self):
+    def initialize(self, pool_sizes=None):
+        """Args:
+            pool_sizes (dict): the number of drops of each stage made before the game starts.
+        """
         self.cleanup()
         self.change_drop_color()
+
+        if pool_sizes is None:
+            pool_sizes = self.pool_sizes
+
+        for key, size in pool_sizes.items():
+            self.pool.warm_up(self.drops[key].model, size)
+
         self.serial = 0
+        self.merge_count = 0
         self.smiley_born = False
         self.is_merging = False
         self.drops_add = []
 
-    def get_start_pos(self, drop):
-        for _ in range(3):
-            x = random.uniform(-6, 6)
-            from_pt = Point3(x, 0, 19)
-            to_pt = Point3(x, 0, 16)
-
-            from_ts = TransformState.make_pos(from_pt)
-            to_ts = TransformState.make_pos(to_pt)
-            result = self.world.sweepTestClosest(
-                drop.node().get_shape(0), from_ts, to_ts, BitMask32.bit(1), 0.0)
-
-            if not result.has_hit():
-                return to_pt
-
     def copy_drop(self, drop, pos):
-        np = drop.copy_to(self)
+        np = self.pool.acquire(drop)
         np.set_name(f'drop_{self.serial}')
-
-        if drop == self.smiley:
-            self.smiley_q.append(np)
-
         self.serial += 1
         np.set_pos(pos)
         self.world.attach(np.node())
+        np.node().set_active(True)
+        self.revision += 1
+        return np
+
+    def find_drop(self, serial):
+        """Return the drop named by copy_drop, or None if it has been deleted."""
+        if not (np := self.find(f'drop_{serial}')).is_empty():
+            return np
 
     def fall(self):
         if len(self.drops_q):
-            key = self.drops_q[0]
-            drop = self.drops[key].model
-
-            if pos := self.get_start_pos(drop):
-                _ = self.drops_q.popleft()
-                self.copy_drop(drop, pos)
-
-    def find_all_neighbours(self, nd, neighbours):
-        """Find all of the balls contacting with each other recursivelly.
-            Args:
-                nd: BulletRigidBodyNode
-                neighbours: set
-        """
-        for con in self.world.contact_test(nd, use_filter=True).get_contacts():
-            con_nd = con.get_node1()
-            if con_nd not in neighbours and con_nd.get_tag('stage'):
-                neighbours.add(con_nd)
-                self.find_all_neighbours(con_nd, neighbours)
-
-    def _neighbours(self, node, tag, neighbours):
-        neighbours.append(node)
-
-        for con in self.world.contact_test(node, use_filter=True).get_contacts():
-            con_nd = con.get_node1()
-            if con_nd not in neighbours and con_nd.get_tag('stage') == tag \
-                    and not con_nd.has_tag('effecting'):
-                self._neighbours(con_nd, tag, neighbours)
+            # as many drops as the credit of the scheduler allows, none while the band is jammed.
+            self.spawner.spawn()
 
     def find_neighbours(self, clicked_nd):
         if not self.is_merging:
-            neighbours = []
             now_stage = clicked_nd.get_tag('stage')
-            self._neighbours(clicked_nd, now_stage, neighbours)
+            neighbours = self.contacts.cluster(clicked_nd, now_stage)
 
             if len(neighbours) >= 2:
                 drop = self.drops[now_stage]
@@ -235,7 +399,7 @@ class Drops(NodePath):
     def set_drop_numbers(self, total):
         for key in self.drops_add[:-1]:
             start = 7 if key == 'd1' else 0
-            prop = random.randint(start, 10) / 10
+            prop = self.rng.randint(start, 10) / 10
             cnt = int(prop * total)
             total -= cnt
             yield key, cnt
@@ -247,65 +411,79 @@ class Drops(NodePath):
         match len(self.drops_add):
             case 0:
                 self.drops_add.append('d1')
-                total = random.randint(30, 40)
+                total = self.rng.randint(*self.spawn_counts[0])
             case 2:
-                total = random.randint(20, 30)
+                total = self.rng.randint(*self.spawn_counts[1])
             case _:
-                total = random.randint(10, 20)
+                total = self.rng.randint(*self.spawn_counts[2])
 
         li = [k for k, v in self.set_drop_numbers(total) for _ in range(v)]
-        random.shuffle(li)
-        self.drops_q.extend(li)
+        self.rng.shuffle(li)
+        self.spawner.push(li)
 
-    def merge(self):
-        try:
-            np = self.vfx_q.pop()
-            score = self.drops[np.get_tag('stage')].score
-
-            if next_stage := np.get_tag('merge'):
-                self.is_merging = False
+    def merge(self, target_nps):
+        """Delete the drops of a cluster at once, and make the next drop at the clicked one.
+            Args:
+                target_nps (list): the drops whose effects have reached the tgt_remove_row.
+        """
+        with profiler.section('merge'):
+            score = 0
+            merged = None
 
-                pos = np.get_pos()
-                next_drop = self.drops[next_stage]
-                score += next_drop.bonus
-                self.copy_drop(next_drop.model, pos)
+            for np in target_nps:
+                score += self.drops[np.get_tag('stage')].score
 
-                if next_drop.appendable and next_stage not in self.drops_add:
-                    self.drops_add.append(next_stage)
-                self.add()
+                # the clicked drop is deleted after the next drop takes its position.
+                if np.get_tag('merge'):
+                    merged = np
+                elif not np.get_tag('first_smiley'):
+                    self.delete(np)
 
-            if not np.get_tag('first_smiley'):
-                self.delete(np)
+            if merged is not None:
+                score += self.merge_into(merged)
+                self.delete(merged)
 
             self.game_board.score_display.add(score)
-        except IndexError:
-            pass
+
+    def merge_into(self, np):
+        """Make the next drop at np, and return its bonus."""
+        next_stage = np.get_tag('merge')
+        self.is_merging = False
+        self.merge_count += 1
+
+        next_drop = self.drops[next_stage]
+        new_np = self.copy_drop(next_drop.model, np.get_pos())
+
+        if next_drop.model == self.smiley:
+            self.jump(new_np)
+
+        if next_drop.appendable and next_stage not in self.drops_add:
+            self.drops_add.append(next_stage)
+        self.add()
+
+        return next_drop.bonus
 
     def finish_jump(self):
         self.jump_seq = None
         self.game_board.merge_display.add(1)
 
-    def jump(self, delay=0.15):
-        try:
-            np = self.smiley_q.popleft()
-            vfx = self.drops[np.get_tag('stage')].vfx
-
-            if not self.smiley_born:
-                np.node().set_tag('first_smiley', 'true')
-                self.smiley_born = True
-
-            self.jump_seq = Sequence(
-                Wait(delay),
-                Func(self.smiley.make_movable, np.node()),
-                SmileyRollingJumpInterval(np),
-                Func(self.add),
-                Func(self.vfx.start, vfx, np),
-                Func(self.finish_jump)
-            )
-            self.jump_seq.start()
-
-        except IndexError:
-            pass
+    def jump(self, np, delay=0.15):
+        vfx = self.drops[np.get_tag('stage')].vfx
+
+        if not self.smiley_born:
+            np.node().set_tag('first_smiley', 'true')
+            self.smiley_born = True
+
+        self.jump_seq = Sequence(
+            Wait(delay),
+            Func(self.wake_neighbours, np.node()),
+            Func(self.smiley.make_movable, np.node()),
+            SmileyRollingJumpInterval(np),
+            Func(self.add),
+            Func(self.vfx.start, vfx, np),
+            Func(self.finish_jump)
+        )
+        self.jump_seq.start()
 
 
 class SmileyRollingJumpInterval(Parallel):
@@ -1,6 +1,7 @@
 from typing import NamedTuple
 
 from direct.gui.DirectGui import OnscreenText
+from direct.showbase.ShowBaseGlobal import globalClock
 from panda3d.bullet import BulletRigidBodyNode
 from panda3d.bullet import BulletTriangleMeshShape, BulletTriangleMesh
 from panda3d.bullet import BulletConvexHullShape
@@ -9,6 +10,7 @@ from panda3d.core import Vec3, Point3, BitMask32, LColor
 from panda3d.core import TextNode
 from panda3d.core import TransformState
 
+from assets import assets
 from create_geomnode import Cube, RightTriangularPrism
 
 
@@ -88,25 +90,9 @@ class Cabinet(NodePath):
         self.node().add_shape(shape, TransformState.make_pos_hpr(pos, hpr))
 
 
-class BottomSensor(NodePath):
-
-    def __init__(self):
-        super().__init__(BulletRigidBodyNode('sensor'))
-        cm = CardMaker('card')
-        cm.set_frame(-5, 5, -1, 1)
-        geomnode = cm.generate()
-        geom = geomnode.get_geom(0)
-        mesh = BulletTriangleMesh()
-        mesh.add_geom(geom)
-        shape = BulletTriangleMeshShape(mesh, dynamic=False)
-        self.node().add_shape(shape)
-        self.set_p(-90)
-        self.set_collide_mask(BitMask32.bit(3))
-
-
 class GameBoard(NodePath):
 
-    def __init__(self, world):
+    def __init__(self, world, display_type=None):
         super().__init__(PandaNode('game_board'))
         self.world = world
 
@@ -114,12 +100,11 @@ class GameBoard(NodePath):
         self.cabinet.reparent_to(self)
         self.world.attach(self.cabinet.node())
 
-        self.score_display = NumberDisplay('score_display', (0.05, -0.2))
-        self.merge_display = NumberDisplay('num_display', (2.5, -0.2))
+        if display_type is None:
+            display_type = NumberDisplay
 
-        self.sensor = BottomSensor()
-        self.sensor.reparent_to(self)
-        self.world.attach(self.sensor.node())
+        self.score_display = display_type('score_display', (0.05, -0.2), count_up=0.5)
+        self.merge_display = display_type('num_display', (2.5, -0.2), blank_zero=True)
 
     def is_outside(self, np):
         pos = np.get_pos()
@@ -128,8 +113,8 @@ class GameBoard(NodePath):
             return True
 
     def initialize(self):
-        self.score_display.setText('0')
-        self.merge_display.setText('')
+        self.score_display.reset()
+        self.merge_display.reset()
 
     def show_displays(self):
         self.score_display.show()
@@ -139,29 +124,20 @@ class GameBoard(NodePath):
         self.score_display.hide()
         self.merge_display.hide()
 
-    def sense_contact(self):
-        for con in self.world.contact_test(self.sensor.node(), use_filter=True).get_contacts():
-            nd = con.get_node0()
-            yield nd
-
-    def maybe_overflow(self):
-        from_pt = self.cabinet.dims.top_left + Vec3(0, 0, 1)
-        to_pt = self.cabinet.dims.top_right + Vec3(0, 0, 1)
-
-        result = self.world.ray_test_closest(
-            from_pt,
-            to_pt,
-            BitMask32.bit(3)
-        )
-        return result.has_hit()
-
 
 class NumberDisplay(OnscreenText):
-
-    def __init__(self, name, pos, scale=0.1, fg=(1, 1, 1, 1), text=''):
-        font = base.loader.loadFont('font/Candaral.ttf')
+    """Show an integer. The text is updated by a task at most once per frame,
+       however many times the number is changed in the frame.
+        Args:
+            blank_zero (bool): if True, nothing is shown while the number is 0.
+            count_up (float): seconds taken to count up to the number after it is added to;
+                0 shows the number at once.
+    """
+
+    def __init__(self, name, pos, scale=0.1, fg=(1, 1, 1, 1), blank_zero=False, count_up=0):
+        font = assets.get_font('font/Candaral.ttf')
         super().__init__(
-            text=text,
+            text='',
             parent=base.a2dTopLeft,
             align=TextNode.ALeft,
             pos=pos,
@@ -171,23 +147,43 @@ class NumberDisplay(OnscreenText):
             mayChange=True
         )
         self.set_name(name)
-
-    def add(self, num):
-        if not (t := self.getText()):
-            t = '0'
-        added = int(t) + num
-        self.setText(str(added))
+        self.blank_zero = blank_zero
+        self.count_up = count_up
+        self.task_name = f'update_{name}'
+        # nothing is shown until reset at the start of a game.
+        self.value = 0
+        self.shown = 0
+        self.rate = 0
 
     @property
     def score(self):
-        if not (score := self.getText()):
-            score = 0
-        return int(score)
+        return self.value
+
+    def set_number(self, num):
+        self.setText('' if self.blank_zero and not num else str(num))
+
+    def reset(self, num=0):
+        base.task_mgr.remove(self.task_name)
+        self.value = self.shown = num
+        self.set_number(num)
+
+    def add(self, num):
+        self.value += num
+
+        if self.count_up > 0:
+            self.rate = (self.value - self.shown) / self.count_up
+
+        if not base.task_mgr.hasTaskNamed(self.task_name):
+            base.task_mgr.add(self.update, self.task_name)
+
+    def update(self, task):
+        if self.count_up > 0:
+            self.shown = min(self.value, self.shown + self.rate * globalClock.get_dt())
+        else:
+            self.shown = self.value
 
-    def show_score(self, num, positive_only=False):
-        if positive_only:
-            if not num:
-                self.setText('')
-                return
+        self.set_number(int(self.shown))
 
-        self.setText(str(num))
\ No newline at end of file
+        if self.shown < self.value:
+            return task.cont
+        return task.done
\ No newline at end of file
@@ -2,7 +2,9 @@ from enum import Enum, auto
 
 from direct.interval.IntervalGlobal import Sequence, Parallel, Func
 from direct.showbase.ShowBaseGlobal import globalClock
-from panda3d.core import NodePath
+
+from height_profile import HeightProfile
+from profiler import profiler
 
 
 class Status(Enum):
@@ -34,20 +36,32 @@ class WarningSequence(Sequence):
 
 
 class GameControl:
-
-    def __init__(self, game_board, drops):
+    """Args:
+            game_board (GameBoard)
+            drops (Drops)
+            overflow_limit (int): the game is over when this number of the resting drops are above the top line,
+            confirm_time (float): for these seconds without merging.
+    """
+
+    def __init__(self, game_board, drops, overflow_limit=20, confirm_time=2):
         self.game_board = game_board
         self.drops = drops
-        self.timer = 7
+        self.heights = HeightProfile(drops, game_board.cabinet.dims)
+        self.overflow_limit = overflow_limit
+        self.confirm_time = confirm_time
         self.state = None
+        self.watching = False
+        self.overflow_since = None
 
     def initialize(self):
         self.drops.initialize()
         self.game_board.initialize()
+        self.heights.clear()
 
     def start(self):
         self.game_board.show_displays()
-        self.before = globalClock.get_frame_time()
+        self.watching = True
+        self.overflow_since = None
         self.state = Status.PROCESSING
 
     def process(self):
@@ -57,19 +71,29 @@ class GameControl:
                 return False
 
             case Status.PROCESSING:
-                self.drops.fall()
-                self.drops.merge()
-                self.drops.jump()
-
-                if self.before is not None \
-                        and globalClock.get_frame_time() - self.before >= self.timer:
-                    if self.game_board.maybe_overflow():
-                        base.task_mgr.do_method_later(2, self.confirm_overflow, 'confirm')
-                        self.before = None
-                    else:
-                        self.before = globalClock.get_frame_time()
+                # merges and jumps are run by the events of the effects, not polled every frame.
+                if self.drops.drops_q:
+                    with profiler.section('fall'):
+                        self.drops.fall()
+
+                if self.watching:
+                    with profiler.section('overflow'):
+                        self.check_overflow()
         return True
 
+    def check_overflow(self):
+        """Finish the game if too many drops have stayed above the top line for confirm_time.
+           The height profile is updated by the physics steps, so this is a sum over its columns.
+           Merges do not reset the time; a merge in progress only puts off the judgment until it ends.
+        """
+        if self.heights.overflow_count() < self.overflow_limit:
+            self.overflow_since = None
+        elif self.overflow_since is None:
+            self.overflow_since = globalClock.get_frame_time()
+        elif globalClock.get_frame_time() - self.overflow_since >= self.confirm_time \
+                and not self.drops.is_merging:
+            self.state = Status.FINISH
+
     def end_process(self):
         self.game_board.hide_displays()
         base.messenger.send('finish')
@@ -79,35 +103,8 @@ class GameControl:
         overflow = [np for np in self.drops.get_children() if self.game_board.is_outside(np)]
         WarningSequence(overflow, self.end_process).start()
 
-    def judge(self):
-        if len([np for np in self.find_overflow()]) >= 20:
-            self.state = Status.FINISH
-        else:
-            self.state = Status.PROCESSING
-            self.before = globalClock.get_frame_time()
-
-    def confirm_overflow(self, task):
-        if self.drops.is_merging:
-            return task.again
-
-        self.judge()
-        return task.done
-
-    def find_overflow(self):
-        """Find objects not in the air and not int the gameboard cabinet."""
-        neighbours = set()
-
-        for nd in self.game_board.sense_contact():
-            self.drops.find_all_neighbours(nd, neighbours)
-
-        for nd in neighbours:
-            np = NodePath(nd)
-            if self.game_board.is_outside(np):
-                yield np
-
     def pause_game(self):
         if self.state == Status.PROCESSING:
-            self.before = None
+            self.watching = False
             self.game_board.hide_displays()
-            base.task_mgr.remove('confirm')
-            return True
\ No newline at end of file
+            return True
@@ -0,0 +1,352 @@
+"""Play games without a window, shadows, GUI and visual effects, as fast as the CPU allows.
+   Run from the repository root: python headless.py --games 10
+   To record the games and replay one of them:
+       python headless.py --games 10 --seed 1 --record logs
+       python headless.py --replay logs/game_3.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+from typing import NamedTuple
+
+from panda3d.core import load_prc_file_data, ClockObject
+from direct.showbase.ShowBase import ShowBase
+from direct.interval.IntervalGlobal import ivalMgr
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.bullet import BulletWorld
+from panda3d.core import Vec3, NodePath
+
+from contacts import ContactSnapshot
+from drops import Drops, SPAWN_COUNTS, SPAWN_RATE
+from game_board import GameBoard
+from game_control import GameControl
+from physics import PhysicsStepper
+from profiler import profiler
+from replay import Recorder, ReplayLog, ReplayPolicy
+
+
+class NullDisplay:
+    """Replaces NumberDisplay; keeps the number without drawing it."""
+
+    def __init__(self, name, pos, **kwargs):
+        self.name = name
+        self.value = 0
+
+    @property
+    def score(self):
+        return self.value
+
+    def reset(self, num=0):
+        self.value = num
+
+    def add(self, num):
+        self.value += num
+
+    def show(self):
+        pass
+
+    def hide(self):
+        pass
+
+
+class SimulatedVFXHandler:
+    """Replaces VFXHandler; sends the targets-removed event at the time
+       the effects would remove the targets, without drawing anything.
+    """
+
+    def start(self, vfx_settings, *targets, delay=0.05):
+        target_nps = []
+
+        for target in targets:
+            target_np = NodePath(target)
+            target_np.set_tag('effecting', '')
+            target_nps.append(target_np)
+
+        base.taskMgr.do_method_later(
+            delay + vfx_settings.tgt_remove_time, self.remove, 'vfx', extraArgs=[target_nps])
+
+    def remove(self, target_nps):
+        base.messenger.send('targets-removed', [target_nps])
+
+    def cleanup(self):
+        base.taskMgr.remove('vfx')
+
+
+class RandomPolicy:
+    """Click a random drop at regular intervals.
+        Args:
+            interval (int): the number of frames between clicks.
+            rng (random.Random)
+    """
+
+    def __init__(self, interval=30, rng=None):
+        self.interval = interval
+        self.rng = random.Random() if rng is None else rng
+
+    def act(self, game):
+        if game.frame % self.interval == 0 and (children := game.drops.get_children()):
+            game.click(self.rng.choice(children).node())
+
+
+class GreedyPolicy(RandomPolicy):
+    """Click one of the drops in the biggest cluster at regular intervals."""
+
+    def act(self, game):
+        if game.frame % self.interval or game.drops.is_merging:
+            return
+
+        biggest = []
+        visited = set()
+
+        for np in game.drops.get_children():
+            if (nd := np.node()) not in visited and not nd.has_tag('effecting'):
+                cluster = game.contacts.cluster(nd, nd.get_tag('stage'))
+                visited.update(cluster)
+
+                if len(cluster) > len(biggest):
+                    biggest = cluster
+
+        if len(biggest) >= 2:
+            game.click(self.rng.choice(biggest))
+
+
+POLICIES = dict(random=RandomPolicy, greedy=GreedyPolicy)
+
+
+class GameResult(NamedTuple):
+
+    seed: int
+    score: int
+    merges: int
+    frames: int
+    sim_time: float
+    wall_time: float
+    finished: bool
+    spawn_latency: float = 0
+    max_queued: int = 0
+
+
+class HeadlessGame(ShowBase):
+    """Args:
+            policy: an object having act(game), which is called every frame to click drops.
+            fixed_dt (float): simulation time of a frame.
+            spawn_counts (tuple): passed to Drops.
+            spawn_rate (tuple): passed to Drops.
+            frames (list): [substeps, dt] of the frames of a game recorded on screen, see ReplayLog;
+                None means a physics step of fixed_dt a frame.
+    """
+
+    def __init__(self, policy=None, fixed_dt=1 / 60, spawn_counts=SPAWN_COUNTS, spawn_rate=SPAWN_RATE,
+                 frames=None):
+        load_prc_file_data('', 'window-type none\naudio-library-name null\nnotify-level-util error')
+        super().__init__()
+        self.policy = RandomPolicy() if policy is None else policy
+        self.fixed_dt = fixed_dt
+        self.spawn_counts = spawn_counts
+        self.spawn_rate = spawn_rate
+        self.frames = frames
+        self.max_substeps = 1 if frames is None else max(max(substeps for substeps, _ in frames), 1)
+
+        # every task_mgr.step advances the clock by fixed_dt, regardless of wall time.
+        globalClock.set_mode(ClockObject.M_non_real_time)
+        globalClock.set_frame_rate(1 / fixed_dt)
+
+        self.world = None
+        self.frame = 0
+        self.playing = False
+        self.finished = False
+        self.replay_recorder = None
+        self.frame_times = array('d')
+        self.accept('finish', self.finish)
+
+    def setup(self):
+        """Make a new world for each game; bullet's broadphase keeps the history of the bodies,
+           which changes the order of the contacts in the next game.
+        """
+        self.world = BulletWorld()
+        self.world.set_gravity(Vec3(0, 0, -9.81))
+        self.physics = PhysicsStepper(self.world, fixed_dt=self.fixed_dt, max_substeps=self.max_substeps)
+
+        self.contacts = ContactSnapshot(self.world)
+        self.physics.add_callback(self.contacts.update)
+        self.game_board = GameBoard(self.world, display_type=NullDisplay)
+        self.game_board.reparent_to(self.render)
+        self.drops = Drops(self.world, self.game_board, self.contacts, vfx_handler=SimulatedVFXHandler,
+                           spawn_counts=self.spawn_counts, spawn_rate=self.spawn_rate)
+        self.drops.reparent_to(self.render)
+        self.physics.add_callback(self.drops.update_activity)
+        self.game_control = GameControl(self.game_board, self.drops)
+        self.physics.add_callback(self.game_control.heights.update)
+        self.physics.add_callback(self.drops.slots.update)
+        self.physics.add_callback(lambda: self.drops.spawner.advance(self.physics.sim_dt))
+
+        profiler.watch('contacts', self.contacts.stats)
+        profiler.watch('physics', lambda: dict(substeps=self.physics.total_substeps))
+        profiler.watch('pool', self.drops.pool.stats)
+        profiler.gauge('drops', self.drops.levels)
+        profiler.watch('slots', self.drops.slots.stats)
+        profiler.gauge('slots', self.drops.slots.levels)
+        profiler.watch('spawn', self.drops.spawner.stats)
+        profiler.gauge('spawn', self.drops.spawner.levels)
+
+    def teardown(self):
+        self.drops.cleanup()
+        self.drops.ignore_all()
+
+        # the blinking of the overflowed drops might be left if max_frames have passed.
+        for ival in ivalMgr.getIntervalsMatching('*'):
+            ival.pause()
+
+        self.drops.remove_node()
+        self.game_board.remove_node()
+
+    def finish(self):
+        self.finished = True
+
+    @property
+    def tick(self):
+        """The number of physics steps since the game started; the same as frame without recorded frames."""
+        return self.physics.total_substeps
+
+    def click(self, nd):
+        self.replay_recorder.click(self.tick, nd)
+        self.drops.find_neighbours(nd)
+
+    def start(self, seed=None):
+        if self.world is not None:
+            self.teardown()
+
+        self.setup()
+        # timers compare float sums of the frame times; start every game from the same time.
+        globalClock.reset()
+        self.replay_recorder = Recorder(seed, self.fixed_dt)
+        self.drops.seed(self.replay_recorder.seed)
+        self.game_control.initialize()
+        self.game_control.start()
+        self.drops.add()
+        self.frame = 0
+        self.playing = True
+        self.finished = False
+
+    def step(self):
+        profiler.begin_frame()
+
+        if not self.game_control.process():
+            self.playing = False
+
+        if self.playing:
+            with profiler.section('click'):
+                self.policy.act(self)
+
+        with profiler.section('physics'):
+            self.physics.step(self.frame_dt())
+
+        self.task_mgr.step()
+        profiler.end_frame()
+        self.frame += 1
+
+    def frame_dt(self):
+        """Return the simulation time of this frame. With recorded frames, it runs the recorded physics steps,
+           and the clock, which ticks at the end of the frame, advances by the recorded time of the next frame.
+        """
+        if self.frames is None:
+            return self.fixed_dt
+
+        if self.frame + 1 < len(self.frames):
+            globalClock.set_dt(self.frames[self.frame + 1][1])
+
+        return self.frames[self.frame][0] * self.fixed_dt
+
+    def play(self, max_frames=60 * 60 * 30, seed=None):
+        """Play a game until it is over or max_frames have passed.
+           The clicks are recorded in self.replay_recorder, and the wall time of each frame in self.frame_times.
+        """
+        self.start(seed)
+        self.frame_times = array('d')
+        start = time.perf_counter()
+
+        while not self.finished and self.frame < max_frames:
+            frame_start = time.perf_counter()
+            self.step()
+            self.frame_times.append(time.perf_counter() - frame_start)
+
+        return GameResult(
+            seed=self.replay_recorder.seed,
+            score=self.game_board.score_display.score,
+            merges=self.drops.merge_count,
+            frames=self.frame,
+            sim_time=self.tick * self.fixed_dt,
+            wall_time=time.perf_counter() - start,
+            finished=self.finished,
+            spawn_latency=self.drops.spawner.mean_latency(),
+            max_queued=self.drops.spawner.max_queued
+        )
+
+
+def print_result(name, result):
+    print(f'{name}: seed={result.seed} score={result.score} merges={result.merges} frames={result.frames} '
+          f'sim={result.sim_time:.1f}s wall={result.wall_time:.2f}s finished={result.finished} '
+          f'spawn_latency={result.spawn_latency:.2f}s max_queued={result.max_queued}')
+
+
+def main(games, max_frames, seed=None, record_dir=None, profile=None):
+    game = HeadlessGame()
+
+    if profile:
+        profiler.resize(max_frames * games)
+        profiler.enable()
+
+    total_frames = 0
+    total_time = 0
+
+    if record_dir:
+        os.makedirs(record_dir, exist_ok=True)
+
+    for i in range(games):
+        result = game.play(max_frames, None if seed is None else seed + i)
+        total_frames += result.frames
+        total_time += result.wall_time
+        print_result(f'game {i}', result)
+
+        if record_dir:
+            log = game.replay_recorder.log(result.frames, result.score)
+            log.save(os.path.join(record_dir, f'game_{i}.json'))
+
+    print(f'{total_frames / total_time:.0f} frames/s, {total_frames * game.fixed_dt / total_time:.1f}x real time')
+
+    if profile:
+        profiler.dump(profile)
+
+
+def replay(path):
+    """Replay a recorded game and check that it ends with the recorded score."""
+    log = ReplayLog.load(path)
+    policy = ReplayPolicy(log)
+    game = HeadlessGame(policy, log.fixed_dt, frames=log.frames)
+    result = game.play(log.ticks if log.frames is None else len(log.frames), log.seed)
+    print_result('replay', result)
+
+    if policy.missed or (result.score, game.tick) != (log.score, log.ticks):
+        print(f'diverged: recorded score={log.score} frames={log.ticks}, {policy.missed} clicks missed')
+        return False
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--max-frames', type=int, default=60 * 60 * 30)
+    parser.add_argument('--seed', type=int, help='seed of the first game; the others follow it.')
+    parser.add_argument('--record', metavar='DIR', help='save the log of each game in DIR.')
+    parser.add_argument('--replay', metavar='FILE', help='replay a recorded game.')
+    parser.add_argument('--profile', metavar='STEM', help='save the time of each frame in STEM.json and STEM.csv.')
+    args = parser.parse_args()
+
+    if args.replay:
+        sys.exit(0 if replay(args.replay) else 1)
+
+    main(args.games, args.max_frames, args.seed, args.record, args.profile)
@@ -0,0 +1,104 @@
+import math
+
+
+class HeightProfile:
+    """Keep the highest top of the resting drops and the number of the resting drops above the top line
+       in each column of the cabinet, updated from the transforms of the drops moved in physics steps.
+        Args:
+            drops (Drops)
+            dims (Dimensions): of the cabinet.
+            column_width (float)
+            rest_speed (float): drops slower than this are regarded as resting on the pile;
+                above the top line, they also need to be supported, see is_resting.
+    """
+
+    def __init__(self, drops, dims, column_width=0.5, rest_speed=0.5):
+        self.drops = drops
+        self.dims = dims
+        self.column_width = column_width
+        self.rest_speed_sq = rest_speed ** 2
+        self.n = math.ceil((dims.right - dims.left) / column_width)
+        self.clear()
+
+    def clear(self):
+        self.tops = [-math.inf] * self.n
+        self.counts = [0] * self.n
+        self.columns = [{} for _ in range(self.n)]
+        self.entries = {}
+        self.revision = None
+
+    def column(self, x):
+        return min(max(int((x - self.dims.left) / self.column_width), 0), self.n - 1)
+
+    def update(self):
+        """Place the drops moved since the last call; call after physics steps."""
+        self.drops.update_index(self)
+
+    def place(self, np):
+        nd = np.node()
+        pos = np.get_pos()
+        above = self.is_above(pos)
+        col = self.column(pos.x)
+        # None while falling, otherwise (top, above the line).
+        # the drops are round enough to take the radius as the half height.
+        entry = (pos.z + self.drops.radius(nd.get_tag('stage')), above) if self.is_resting(nd, above) else None
+        old_col, old_entry = self.entries.get(nd, (None, None))
+
+        if (old_col, old_entry) == (col, entry):
+            return
+
+        if old_col is not None:
+            self.remove(nd)
+
+        self.entries[nd] = (col, entry)
+
+        if entry is not None:
+            top, above = entry
+            self.columns[col][nd] = top
+            self.tops[col] = max(self.tops[col], top)
+            self.counts[col] += above
+
+    def is_resting(self, nd, above):
+        """A new drop and a bouncing one at its top are also slow; above the top line, where they are counted,
+           slow drops must touch the cabinet, a sleeping drop or a resting one.
+           The contacts are read only for them, not to build the contact snapshot every step.
+        """
+        if not nd.is_active():
+            return True
+
+        if nd.get_linear_velocity().length_squared() >= self.rest_speed_sq:
+            return False
+
+        return not above or self.is_supported(nd)
+
+    def is_supported(self, nd):
+        for con_nd in self.drops.contacts.contacts(nd):
+            if not con_nd.get_tag('stage') or not con_nd.is_active():
+                return True
+
+            if con_nd in self.entries and self.entries[con_nd][1] is not None:
+                return True
+
+        return False
+
+    def remove(self, nd):
+        col, entry = self.entries.pop(nd)
+
+        if entry is not None:
+            top, above = entry
+            del self.columns[col][nd]
+            self.counts[col] -= above
+
+            if top >= self.tops[col]:
+                self.tops[col] = max(self.columns[col].values(), default=-math.inf)
+
+    def is_above(self, pos):
+        """The same as GameBoard.is_outside."""
+        return self.dims.left < pos.x < self.dims.right and pos.z > self.dims.top
+
+    def overflow_count(self):
+        """Return the number of the resting drops above the top line."""
+        return sum(self.counts)
+
+    def max_height(self):
+        return max(self.tops)
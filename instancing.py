@@ -0,0 +1,144 @@
+from array import array
+
+from panda3d.core import NodePath, PandaNode
+from panda3d.core import Texture, GeomEnums, OmniBoundingVolume
+from panda3d.core import TransparencyAttrib
+
+from utils import load_shader
+
+
+# texels per instance: 4 rows of the transform and the color scale.
+TEXELS = 5
+
+# the tag selecting the shadow pass state of the instanced drops.
+SHADOW_STATE_KEY = 'shadow_state'
+
+
+class InstanceBuffer:
+    """A buffer texture holding the transforms and the color scales of the instances.
+        Args:
+            capacity (int): the number of instances; the buffer grows when exceeded.
+    """
+
+    def __init__(self, capacity=64):
+        self.texture = Texture('instances')
+        self.capacity = 0
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        self.texture.setup_buffer_texture(
+            capacity * TEXELS, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+
+    def upload(self, values, count):
+        """Args:
+            values (array): 4 * TEXELS floats per instance.
+            count (int): the number of instances.
+        """
+        if count > self.capacity:
+            self.resize(max(count, self.capacity * 2))
+
+        ram_image = memoryview(self.texture.modify_ram_image()).cast('B')
+        data = memoryview(values).cast('B')
+        ram_image[:len(data)] = data
+
+
+class InstancedStage(NodePath):
+    """Draw the drops of a stage in one call with a copy of the geometry of the stage's model.
+        Args:
+            tag (str): stage
+            model (Convex): the model of the stage; its own geometry is stashed
+                to draw nothing, and the drops copied from it do the same.
+            shader (Shader)
+    """
+
+    def __init__(self, tag, model, shader):
+        super().__init__(PandaNode(f'instanced_{tag}'))
+        self.buffer = InstanceBuffer()
+        self.values = array('f')
+        self.count = 0
+
+        geom_np = model.get_child(0)
+        geom_np.copy_to(self)
+        geom_np.stash()
+
+        # the instances are anywhere in the cabinet, not in the bounds of the geometry.
+        self.node().set_bounds(OmniBoundingVolume())
+        self.node().set_final(True)
+        self.set_transparency(TransparencyAttrib.MAlpha)
+        self.set_shader(shader)
+        self.set_shader_input('instances', self.buffer.texture)
+        self.set_tag(SHADOW_STATE_KEY, 'instanced')
+        self.set_instance_count(0)
+
+    def clear(self):
+        del self.values[:]
+        self.count = 0
+
+    def add(self, np):
+        mat = np.get_mat()
+
+        for i in range(4):
+            self.values.extend(mat.get_row(i))
+
+        self.values.extend(np.get_color_scale())
+        self.count += 1
+
+    def flush(self):
+        if self.count:
+            self.buffer.upload(self.values, self.count)
+
+        self.set_instance_count(self.count)
+
+
+class InstancedRenderer(NodePath):
+    """Draw the drops of each stage in one call instead of a call per drop.
+       The physics bodies keep no visible geometry; their transforms are copied
+       into the buffers of the stages every frame.
+        Args:
+            drops (Drops)
+            light (NodePath): the directional light casting the shadows.
+    """
+
+    def __init__(self, drops, light=None):
+        super().__init__(PandaNode('instanced_drops'))
+        self.drops = drops
+        self.stages = {}
+        self.shader = load_shader('instanced.vert', 'instanced.frag')
+
+        if light is not None:
+            self.setup_shadow_pass(light)
+
+    def setup_shadow_pass(self, light):
+        shadow_shader = load_shader('instanced.vert', 'instanced_shadow.frag')
+        state = NodePath(PandaNode('shadow_state'))
+        state.set_shader(shadow_shader, 1)
+        light.node().set_tag_state_key(SHADOW_STATE_KEY)
+        light.node().set_tag_state('instanced', state.get_state())
+
+    def set_models(self, models):
+        """Call whenever the models of the stages are made.
+            Args:
+                models (dict): {stage: Convex}
+        """
+        for stage in self.stages.values():
+            stage.remove_node()
+
+        self.stages = {tag: InstancedStage(tag, model, self.shader) for tag, model in models.items()}
+
+        for stage in self.stages.values():
+            stage.reparent_to(self)
+
+    def update(self):
+        """Copy the transforms of the drops into the buffers; call every frame after the physics step."""
+        self.set_transform(self.drops.get_transform())
+
+        for stage in self.stages.values():
+            stage.clear()
+
+        for np in self.drops.get_children():
+            if (stage := self.stages.get(np.node().get_tag('stage'))) is not None:
+                stage.add(np)
+
+        for stage in self.stages.values():
+            stage.flush()
@@ -1,6 +1,10 @@
 from panda3d.core import AmbientLight, DirectionalLight
 from panda3d.core import NodePath, PandaNode
-from panda3d.core import Vec3, Point3
+from panda3d.core import Vec3, Point3, LMatrix4f
+
+
+# the size of the shadow map of each quality.
+SHADOW_QUALITY = dict(low=1024, medium=2048, high=4096)
 
 
 class BasicAmbientLight(NodePath):
@@ -12,15 +16,20 @@ class BasicAmbientLight(NodePath):
 
 
 class BasicDayLight(NodePath):
+    """Args:
+            quality (str): key of SHADOW_QUALITY; None casts no shadow.
+    """
 
-    def __init__(self):
+    def __init__(self, quality='medium'):
         super().__init__(DirectionalLight('directional_light'))
         self.node().get_lens().set_film_size(200, 200)
         self.node().get_lens().set_near_far(10, 200)
         self.node().set_color((1, 1, 1, 1))
         self.set_pos_hpr(Point3(0, 0, 100), Vec3(-30, -45, 0))
-        self.node().set_shadow_caster(True, 8192, 8192)
-        # self.node().set_shadow_caster(True, 4096, 4096)
+
+        if quality is not None:
+            size = SHADOW_QUALITY[quality]
+            self.node().set_shadow_caster(True, size, size)
 
         state = self.node().get_initial_state()
         temp = NodePath(PandaNode('temp_np'))
@@ -31,4 +40,54 @@ class BasicDayLight(NodePath):
 
         base.render.set_light(self)
         base.render.set_shader_auto()
-        # self.node().show_frustum()
\ No newline at end of file
+        # self.node().show_frustum()
+
+        self.casters = None
+        self.last_mats = {}
+        self.last_revision = None
+
+    def fit(self, np, margin=0.5):
+        """Fit the frustum of the light to the bounds of np seen from the light,
+           so that the whole shadow map is spent on np; call after the light is placed.
+            Args:
+                np (NodePath): such as the cabinet, which the drops do not go out of.
+                margin (float): added to each side of the bounds.
+        """
+        min_pt, max_pt = np.get_tight_bounds(self)
+        lens = self.node().get_lens()
+        lens.set_film_size(max_pt.x - min_pt.x + margin * 2, max_pt.z - min_pt.z + margin * 2)
+        lens.set_film_offset((min_pt.x + max_pt.x) / 2, (min_pt.z + max_pt.z) / 2)
+        lens.set_near_far(max(min_pt.y - margin, 0.1), max_pt.y + margin)
+
+    def skip_still_frames(self, casters, epsilon=1e-3):
+        """Render the shadow map only in the frames when a caster has been added, deleted or moved.
+            Args:
+                casters (Drops): having revision, which is changed whenever a drop is added or deleted.
+                epsilon (float): the change of the transform regarded as a move.
+        """
+        self.casters = casters
+        self.epsilon = epsilon
+        base.task_mgr.add(self.update_shadow, 'update_shadow', sort=45)
+
+    def has_moved(self):
+        if self.casters.revision != self.last_revision:
+            return True
+
+        for np in self.casters.get_children():
+            if (mat := self.last_mats.get(np.node())) is None \
+                    or not np.get_mat().almost_equal(mat, self.epsilon):
+                return True
+
+        return False
+
+    def update_shadow(self, task):
+        # the buffer is made when the light is rendered first.
+        if (buffer := self.node().get_shadow_buffer(base.win.get_gsg())) is None:
+            return task.cont
+
+        if moved := self.has_moved():
+            self.last_revision = self.casters.revision
+            self.last_mats = {np.node(): LMatrix4f(np.get_mat()) for np in self.casters.get_children()}
+
+        buffer.set_active(moved)
+        return task.cont
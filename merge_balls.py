@@ -1,17 +1,29 @@
+import argparse
+import atexit
 import logging
 import sys
+import time
+from datetime import datetime
 from enum import Enum, auto
 
+import direct.gui.DirectGuiGlobals as DGG
 from direct.showbase.ShowBaseGlobal import globalClock
 from direct.showbase.ShowBase import ShowBase
 from panda3d.bullet import BulletWorld, BulletDebugNode
 from panda3d.core import NodePath
 from panda3d.core import Vec3, BitMask32, Point3, LColor
 
+from assets import assets, MANIFEST
 from game_board import GameBoard
 from game_control import GameControl
 from drops import Drops
-from lights import BasicAmbientLight, BasicDayLight
+from contacts import ContactSnapshot
+from physics import PhysicsStepper
+from replay import Recorder
+from instancing import InstancedRenderer
+from profiler import profiler, ProfilerOverlay
+from texture_manager import configure, COMPRESSIONS
+from lights import BasicAmbientLight, BasicDayLight, SHADOW_QUALITY
 from screen import Screen, Button, Frame, Label
 from utils import make_line, set_logger
 
@@ -24,13 +36,33 @@ class Status(Enum):
 
 
 class Game(ShowBase):
-
-    def __init__(self):
+    """Args:
+            record_path (str): if given, the seed, the clicks and the frames of the last game are saved in it.
+                The clicks are recorded by physics steps, and the frames by their physics steps and times,
+                so that headless.py can run the same steps and timers.
+            instanced (bool): if True, the drops of each stage are drawn in one call.
+            shadow_quality (str): key of lights.SHADOW_QUALITY; None casts no shadow.
+    """
+
+    def __init__(self, record_path=None, instanced=False, shadow_quality='medium'):
+        self.start_time = time.perf_counter()
         super().__init__()
         self.disable_mouse()
+        self.record_path = record_path
+        self.replay_recorder = None
+        # total_substeps when the first drops of the recorded game were added.
+        self.start_tick = None
+        self.instanced = instanced
+        self.shadow_quality = shadow_quality
+        # the seconds from the start until the first frame and until the assets are loaded.
+        self.load_times = {}
+
+        # the models and the effect atlases are read in the background while the start screen is shown.
+        assets.load(MANIFEST)
 
         self.world = BulletWorld()
         self.world.set_gravity(Vec3(0, 0, -9.81))
+        self.physics = PhysicsStepper(self.world)
 
         self.camera.set_pos(Point3(0, -35, 7))
         self.camera.set_hpr(Vec3(0, -1.6, 0))
@@ -41,14 +73,38 @@ class Game(ShowBase):
 
         self.ambient_light = BasicAmbientLight()
         self.ambient_light.reparent_to(self.scene)
-        self.day_light = BasicDayLight()
+        self.day_light = BasicDayLight(shadow_quality)
         self.day_light.reparent_to(self.scene)
 
+        self.screen = self.create_gui()
+        self.screen.show()
+        self.state = None
+
+        self.accept('escape', sys.exit)
+        self.taskMgr.add(self.report_first_frame, 'report_first_frame', sort=60)
+        self.taskMgr.add(self.wait_assets, 'wait_assets')
+
+    def setup_game(self):
+        """Make the game board and the drops, which need the assets."""
+        self.contacts = ContactSnapshot(self.world)
+        self.physics.add_callback(self.contacts.update)
         self.game_board = GameBoard(self.world)
         self.game_board.reparent_to(self.scene)
-        self.drops = Drops(self.world, self.game_board)
+        self.drops = Drops(self.world, self.game_board, self.contacts)
         self.drops.reparent_to(self.scene)
+        self.physics.add_callback(self.drops.update_activity)
         self.game_control = GameControl(self.game_board, self.drops)
+        self.physics.add_callback(self.game_control.heights.update)
+        self.physics.add_callback(self.drops.slots.update)
+        self.physics.add_callback(lambda: self.drops.spawner.advance(self.physics.sim_dt))
+
+        if self.shadow_quality is not None:
+            self.day_light.fit(self.game_board.cabinet)
+            self.day_light.skip_still_frames(self.drops)
+
+        if self.instanced:
+            self.drops.instances = InstancedRenderer(self.drops, self.day_light)
+            self.drops.instances.reparent_to(self.scene)
 
         self.debug = self.render.attach_new_node(BulletDebugNode('debug'))
         self.world.set_debug_node(self.debug.node())
@@ -56,24 +112,54 @@ class Game(ShowBase):
             self.game_board.cabinet.dims.top_left, self.game_board.cabinet.dims.top_right, LColor(1, 0, 0, 1))
         self.debug_line.reparent_to(self.debug)
 
-        self.screen = self.create_gui()
-        self.screen.show()
-        self.state = None
+        profiler.watch('contacts', self.contacts.stats)
+        profiler.watch('physics', lambda: dict(substeps=self.physics.total_substeps))
+        profiler.watch('pool', self.drops.pool.stats)
+        profiler.gauge('drops', self.drops.levels)
+        profiler.watch('slots', self.drops.slots.stats)
+        profiler.gauge('slots', self.drops.slots.levels)
+        profiler.watch('spawn', self.drops.spawner.stats)
+        profiler.gauge('spawn', self.drops.spawner.levels)
+        self.profiler_overlay = ProfilerOverlay(profiler)
+        atexit.register(self.dump_profile)
 
-        self.accept('escape', sys.exit)
         self.accept('d', self.toggle_debug)
+        self.accept('p', self.toggle_profiler)
         self.accept('mouse1', self.mouse_click)
         self.accept('finish', self.gameover)
         self.taskMgr.add(self.update, 'update')
 
+    def report_first_frame(self, task):
+        # runs after the frame is rendered by igLoop.
+        self.load_times['first_frame'] = time.perf_counter() - self.start_time
+        print(f"first frame: {self.load_times['first_frame']:.2f}s")
+        return task.done
+
+    def wait_assets(self, task):
+        loaded, total = assets.progress()
+        self.loading_label.setText(f'LOADING {loaded}/{total}')
+
+        if not assets.is_loaded():
+            return task.cont
+
+        self.setup_game()
+        self.loading_label.hide()
+        self.start_btn['state'] = DGG.NORMAL
+        self.load_times['ready'] = time.perf_counter() - self.start_time
+        print(f"ready: {self.load_times['ready']:.2f}s")
+        return task.done
+
     def create_gui(self):
-        font = self.loader.loadFont('font/Candaral.ttf')
+        font = assets.get_font('font/Candaral.ttf')
 
         self.start_frame = Frame(self.aspect2d)
         Label(self.start_frame, 'START', (0, 0, 0.3), font)
-        start_btn = Button(self.start_frame, 'PLAY', (0, 0, 0), font, self.initialize, focus=True)
+        self.start_btn = Button(self.start_frame, 'PLAY', (0, 0, 0), font, self.initialize, focus=True)
+        # enabled after the assets are loaded.
+        self.start_btn['state'] = DGG.DISABLED
         quit_btn1 = Button(self.start_frame, 'QUIT', (0, 0, -0.2), font, lambda: sys.exit())
-        self.start_frame.create_group(start_btn, quit_btn1)
+        self.start_frame.create_group(self.start_btn, quit_btn1)
+        self.loading_label = Label(self.start_frame, '', (0, 0, -0.45), font, text_scale=0.06)
         screen = Screen(self.start_frame)
 
         self.pause_frame = Frame(self.aspect2d, hide=True)
@@ -93,11 +179,23 @@ class Game(ShowBase):
         self.state = Status.PLAY
         self.game_control.start()
         if is_add:
+            # the ticks are counted from the first drops, as HeadlessGame.start does, not from the fade.
+            if self.replay_recorder:
+                self.start_tick = self.physics.total_substeps
+            # the physics steps during the fade have filled the credit; start with none, as HeadlessGame does.
+            self.drops.spawner.clear()
             self.drops.add()
 
     def initialize(self):
         # print('initialize')
         self.ignore('escape')
+
+        if self.record_path:
+            self.start_tick = None
+            self.replay_recorder = Recorder(fixed_dt=self.physics.fixed_dt)
+            # the drops are seeded before initialize, which colors them; nothing draws from rng during the fade.
+            self.drops.seed(self.replay_recorder.seed)
+
         self.game_control.initialize()
         self.screen.fade_out(self.start_game, True)
 
@@ -117,6 +215,14 @@ class Game(ShowBase):
     def gameover(self):
         # print('gameover')
         self.ignore('escape')
+
+        if self.replay_recorder:
+            ticks = self.physics.total_substeps - self.start_tick
+            score = self.game_board.score_display.score
+            self.replay_recorder.log(ticks, score).save(self.record_path)
+            # no more frames are recorded until the next game.
+            self.start_tick = None
+
         self.state = None
         self.screen.gui = self.start_frame
         self.screen.fade_in(self.accept, 'escape', sys.exit)
@@ -129,6 +235,18 @@ class Game(ShowBase):
             self.debug.hide()
             self.day_light.node().hide_frustum()
 
+    def toggle_profiler(self):
+        profiler.toggle()
+
+        if profiler.enabled:
+            self.profiler_overlay.show()
+        else:
+            self.profiler_overlay.hide()
+
+    def dump_profile(self):
+        """Save the frames recorded by the profiler in json and csv files."""
+        profiler.dump(f'profile_{datetime.now().strftime("%Y%m%d%H%M%S")}')
+
     def mouse_click(self):
         self.clicked = True
 
@@ -145,6 +263,7 @@ class Game(ShowBase):
 
     def update(self, task):
         dt = globalClock.get_dt()
+        profiler.begin_frame()
 
         if not self.game_control.process():
             self.state = Status.GAMEOVER
@@ -152,14 +271,39 @@ class Game(ShowBase):
         if self.state == Status.PLAY:
             if self.clicked:
                 if self.mouseWatcherNode.has_mouse():
-                    if player_choice := self.choose(self.mouseWatcherNode.get_mouse()):
-                        self.drops.find_neighbours(player_choice)
+                    with profiler.section('click'):
+                        if player_choice := self.choose(self.mouseWatcherNode.get_mouse()):
+                            if self.replay_recorder:
+                                self.replay_recorder.click(self.physics.total_substeps - self.start_tick, player_choice)
+                            self.drops.find_neighbours(player_choice)
                 self.clicked = False
 
-        self.world.do_physics(dt)
+        with profiler.section('physics'):
+            self.physics.step(dt)
+
+        if self.replay_recorder and self.start_tick is not None:
+            self.replay_recorder.frame(self.physics.substeps, dt)
+
+        if self.drops.instances:
+            with profiler.section('instances'):
+                self.drops.instances.update()
+
+        profiler.end_frame()
+        self.profiler_overlay.update()
         return task.cont
 
 
 if __name__ == '__main__':
-    game = Game()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', metavar='FILE', help='save the seed and the clicks of the game in FILE.')
+    parser.add_argument('--instanced', action='store_true', help='draw the drops of each stage in one call.')
+    parser.add_argument('--mipmap-textures', action='store_true', help='generate the mipmaps of the effect atlases.')
+    parser.add_argument('--compress-textures', choices=COMPRESSIONS.keys(), default='off',
+                        help='compress the effect atlases; the results are cached in cache/textures.')
+    parser.add_argument('--shadow-quality', choices=[*SHADOW_QUALITY.keys(), 'off'], default='medium',
+                        help='the size of the shadow map; off casts no shadow.')
+    args = parser.parse_args()
+    configure(args.mipmap_textures, args.compress_textures)
+    shadow_quality = None if args.shadow_quality == 'off' else args.shadow_quality
+    game = Game(args.record, args.instanced, shadow_quality)
     game.run()
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Compile the vertex and index buffers of the drop models into binary files.
+   The files are memory-mapped when loaded instead of parsing obj files and tessellating spheres.
+   Run from the repository root: python mesh_file.py
+"""
+import hashlib
+import mmap
+import os
+import struct
+from functools import cache
+from typing import NamedTuple
+
+
+COMPILED_DIR = 'objs/compiled'
+MAGIC = b'DRPM'
+VERSION = 2
+
+# the module tessellating the spheres and assigning the color slots; the files made by other code are stale.
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_geomnode.py')
+
+# magic, version, index size, color slot count, floats per vertex, vertex count, index count,
+# sha1 of the source file, mtime_ns of the source file, size of the source file, sha1 of the generator.
+HEADER = struct.Struct('<4sHBBIII20sqq20s')
+
+
+class MeshBuffers(NamedTuple):
+
+    vdata_values: memoryview
+    prim_indices: memoryview
+    vertex_count: int
+    color_slots: memoryview
+    slot_count: int
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+@cache
+def generator_digest():
+    return file_digest(GENERATOR)
+
+
+def write_mesh(path, buffers, source):
+    """Write buffers to path; source is the obj file the buffers were made from.
+        Args:
+            path (str): the compiled file
+            buffers (GeomBuffers)
+            source (str): obj file
+    """
+    vdata = memoryview(buffers.vdata_values).cast('B')
+    indices = memoryview(buffers.prim_indices)
+    slots = memoryview(buffers.color_slots).cast('B')
+    stat = os.stat(source)
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        indices.itemsize,
+        buffers.slot_count,
+        len(vdata) // 4 // buffers.vertex_count,
+        buffers.vertex_count,
+        len(indices),
+        file_digest(source),
+        stat.st_mtime_ns,
+        stat.st_size,
+        generator_digest()
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(vdata)
+        f.write(indices.cast('B'))
+        f.write(slots)
+
+    os.replace(tmp_path, path)
+
+
+def is_fresh(header, source):
+    _, _, _, _, _, _, _, digest, mtime_ns, size, generator = header
+
+    if generator != generator_digest():
+        return False
+
+    stat = os.stat(source)
+
+    if stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+        return True
+
+    # mtime can change without editing, for example by checking out the repository.
+    return stat.st_size == size and file_digest(source) == digest
+
+
+def read_mesh(path, source):
+    """Memory-map the compiled file and return its buffers,
+       or None if it is missing, broken or older than source.
+        Args:
+            path (str): the compiled file
+            source (str): obj file
+    """
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mm) < HEADER.size:
+        return None
+
+    header = HEADER.unpack_from(mm)
+    magic, version, index_size, slot_count, stride, vertex_count, index_count, *_ = header
+
+    if magic != MAGIC or version != VERSION or not is_fresh(header, source):
+        return None
+
+    vdata_end = HEADER.size + stride * vertex_count * 4
+    indices_end = vdata_end + index_count * index_size
+
+    if len(mm) != indices_end + vertex_count:
+        return None
+
+    buf = memoryview(mm)
+
+    return MeshBuffers(
+        buf[HEADER.size:vdata_end].cast('f'),
+        buf[vdata_end:indices_end].cast('H' if index_size == 2 else 'I'),
+        vertex_count,
+        buf[indices_end:],
+        slot_count
+    )
+
+
+def compile_meshes():
+    from colors import theme_colors
+    from create_geomnode import GeomRoot, Sphere, Polyhedron, OBJ_DIR
+
+    GeomRoot.use_compiled = False
+    colors = theme_colors[0]
+    models = [Sphere(colors, pattern=i, shared=shared) for i in range(3) for shared in (False, True)]
+
+    for file_name in sorted(os.listdir(OBJ_DIR)):
+        if file_name.endswith('.obj') and file_name != 'icosahedron.obj':
+            models.append(Polyhedron(colors, file_name))
+
+    for model in models:
+        path = model.compiled_path()
+        write_mesh(path, GeomRoot.buffers[model.cache_key()], model.obj_file)
+        print(f'{model.obj_file} -> {path}')
+
+
+if __name__ == '__main__':
+    compile_meshes()
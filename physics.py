@@ -0,0 +1,94 @@
+import time
+
+
+# tolerance for the rounding errors accumulated by adding frame times.
+EPSILON = 1e-9
+
+
+class PhysicsStepper:
+    """Step the bullet world by fixed time steps, however long a frame takes.
+        Args:
+            world (BulletWorld)
+            fixed_dt (float): simulation time of a substep.
+            max_substeps (int): the maximum number of substeps in a frame.
+            budget (float): wall time in seconds that substeps can take in a frame; None means no limit.
+            interpolate (bool): if True, bullet runs the substeps itself and interpolates
+                the transforms of the bodies between the last two substeps.
+    """
+
+    def __init__(self, world, fixed_dt=1 / 60, max_substeps=4, budget=None, interpolate=False):
+        self.world = world
+        self.fixed_dt = fixed_dt
+        self.max_substeps = max_substeps
+        self.budget = budget
+        self.interpolate = interpolate
+        self.callbacks = []
+
+        self.accumulator = 0
+        self.substeps = 0
+        self.step_times = []
+        self.total_substeps = 0
+        self.dropped_time = 0
+
+    def add_callback(self, callback):
+        """callback is called after the frames in which at least one substep ran."""
+        self.callbacks.append(callback)
+
+    def step(self, dt):
+        self.step_times = []
+
+        if self.interpolate:
+            self.step_interpolated(dt)
+        else:
+            self.step_fixed(dt)
+
+        self.substeps = len(self.step_times)
+        self.total_substeps += self.substeps
+
+        if self.substeps:
+            for callback in self.callbacks:
+                callback()
+
+        return self.substeps
+
+    @property
+    def sim_dt(self):
+        """The simulation time advanced by the last step."""
+        return self.substeps * self.fixed_dt
+
+    def step_fixed(self, dt):
+        self.accumulator += dt
+        frame_start = time.perf_counter()
+
+        while self.accumulator + EPSILON >= self.fixed_dt and len(self.step_times) < self.max_substeps:
+            if self.budget is not None and time.perf_counter() - frame_start >= self.budget:
+                break
+
+            start = time.perf_counter()
+            # max_substeps=0 makes bullet run exactly one step of fixed_dt.
+            self.world.do_physics(self.fixed_dt, 0)
+            self.step_times.append(time.perf_counter() - start)
+            self.accumulator -= self.fixed_dt
+
+        # Drop the time that could not be simulated not to fall further behind.
+        if self.accumulator + EPSILON >= self.fixed_dt:
+            dropped = self.accumulator - self.accumulator % self.fixed_dt
+            self.dropped_time += dropped
+            self.accumulator -= dropped
+
+    def step_interpolated(self, dt):
+        start = time.perf_counter()
+        substeps = self.world.do_physics(dt, self.max_substeps, self.fixed_dt)
+
+        if substeps:
+            elapsed = time.perf_counter() - start
+            self.step_times = [elapsed / substeps] * substeps
+
+    def stats(self):
+        return dict(
+            substeps=self.substeps,
+            step_times=self.step_times,
+            frame_time=sum(self.step_times),
+            total_substeps=self.total_substeps,
+            dropped_time=self.dropped_time
+        )
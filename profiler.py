@@ -0,0 +1,234 @@
+import csv
+import json
+import time
+from collections import deque, defaultdict
+
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import TextNode
+
+
+class Section:
+    """Context manager adding the wall time of its block to a section of the current frame."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.profiler.add(self.name, time.perf_counter() - self.start)
+            self.start = None
+
+
+class FrameProfiler:
+    """Record the wall time and the calls of the sections of each frame into a ring buffer.
+       Nothing is recorded while disabled, except for the cost of checking the flag.
+        Args:
+            capacity (int): the number of frames kept.
+    """
+
+    def __init__(self, capacity=600):
+        self.enabled = False
+        self.frames = deque(maxlen=capacity)
+        self.sections = {}
+        self.sources = {}
+        self.gauges = {}
+        self.last_counts = {}
+        self.current = defaultdict(lambda: [0.0, 0])
+        self.frame_start = None
+        self.frame_count = 0
+
+    def resize(self, capacity):
+        self.frames = deque(self.frames, maxlen=capacity)
+
+    def section(self, name):
+        if (section := self.sections.get(name)) is None:
+            section = self.sections[name] = Section(self, name)
+        return section
+
+    def add(self, name, elapsed, calls=1):
+        record = self.current[name]
+        record[0] += elapsed
+        record[1] += calls
+
+    def watch(self, name, stats):
+        """Record the increase of the counters returned by stats every frame.
+            Args:
+                name (str): prefix of the counters.
+                stats (callable): returns a dict of cumulative counters, like ContactSnapshot.stats.
+        """
+        self.sources[name] = stats
+
+    def gauge(self, name, levels):
+        """Record the values returned by levels every frame as they are, such as the length of a queue.
+            Args:
+                name (str): prefix of the values.
+                levels (callable): returns a dict of the current values.
+        """
+        self.gauges[name] = levels
+
+    def read(self, sources):
+        values = {}
+
+        for name, stats in sources.items():
+            for key, val in stats().items():
+                if isinstance(val, (int, float)):
+                    values[f'{name}.{key}'] = val
+
+        return values
+
+    def read_counts(self):
+        return self.read(self.sources)
+
+    def enable(self):
+        self.enabled = True
+        self.last_counts = self.read_counts()
+
+    def disable(self):
+        self.enabled = False
+        self.frame_start = None
+        self.current.clear()
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def begin_frame(self):
+        self.frame_count += 1
+
+        if self.enabled and self.frame_start is None:
+            self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Record the frame; its total is the wall time since the last end_frame, including rendering,
+           and the sections run by tasks after end_frame are counted in the next frame.
+        """
+        if not self.enabled or self.frame_start is None:
+            return
+
+        now = time.perf_counter()
+        counts = self.read_counts()
+        self.frames.append(dict(
+            frame=self.frame_count,
+            total=now - self.frame_start,
+            sections={name: tuple(record) for name, record in self.current.items()},
+            counters={key: val - self.last_counts.get(key, 0) for key, val in counts.items()},
+            gauges=self.read(self.gauges)
+        ))
+        self.current.clear()
+        self.last_counts = counts
+        self.frame_start = now
+
+    def summary(self, last=None):
+        """Return the average time per frame in ms and the calls per frame of each section,
+           the average counters per frame and the average gauges, over the last frames.
+        """
+        frames = list(self.frames)[-last:] if last else list(self.frames)
+
+        if not frames:
+            return dict(frames=0, total=0, sections={}, counters={}, gauges={})
+
+        n = len(frames)
+        sections = defaultdict(lambda: [0.0, 0])
+        counters = defaultdict(int)
+        gauges = defaultdict(int)
+
+        for record in frames:
+            for name, (elapsed, calls) in record['sections'].items():
+                sections[name][0] += elapsed
+                sections[name][1] += calls
+
+            for key, val in record['counters'].items():
+                counters[key] += val
+
+            for key, val in record['gauges'].items():
+                gauges[key] += val
+
+        return dict(
+            frames=n,
+            total=sum(record['total'] for record in frames) / n * 1000,
+            sections={name: (elapsed / n * 1000, calls / n) for name, (elapsed, calls) in sections.items()},
+            counters={key: val / n for key, val in counters.items()},
+            gauges={key: val / n for key, val in gauges.items()}
+        )
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict(summary=self.summary(), frames=list(self.frames)), f)
+
+    def dump_csv(self, path):
+        """Write a row per frame; a section has the columns of its time in ms and calls."""
+        names = sorted({name for record in self.frames for name in record['sections']})
+        keys = sorted({key for record in self.frames for key in record['counters']})
+        levels = sorted({key for record in self.frames for key in record['gauges']})
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ['frame', 'total_ms'] + [f'{n}_{c}' for n in names for c in ('ms', 'calls')] + keys + levels)
+
+            for record in self.frames:
+                row = [record['frame'], record['total'] * 1000]
+
+                for name in names:
+                    elapsed, calls = record['sections'].get(name, (0, 0))
+                    row += [elapsed * 1000, calls]
+
+                row += [record['counters'].get(key, 0) for key in keys]
+                row += [record['gauges'].get(key, 0) for key in levels]
+                writer.writerow(row)
+
+    def dump(self, path_stem):
+        """Write path_stem.json and path_stem.csv, if any frame has been recorded."""
+        if self.frames:
+            self.dump_json(f'{path_stem}.json')
+            self.dump_csv(f'{path_stem}.csv')
+            return True
+
+
+class ProfilerOverlay(OnscreenText):
+    """Show the summary of the last frames on screen.
+        Args:
+            profiler (FrameProfiler)
+            interval (int): the number of frames between updates of the text.
+    """
+
+    def __init__(self, profiler, interval=30):
+        super().__init__(
+            text='',
+            parent=base.a2dTopLeft,
+            align=TextNode.ALeft,
+            pos=(0.05, -0.35),
+            scale=0.04,
+            fg=(1, 1, 1, 1),
+            bg=(0, 0, 0, 0.5),
+            mayChange=True
+        )
+        self.profiler = profiler
+        self.interval = interval
+        self.hide()
+
+    def update(self):
+        if self.is_hidden() or self.profiler.frame_count % self.interval:
+            return
+
+        summary = self.profiler.summary(self.interval)
+        lines = [f"frame {summary['total']:.2f}ms"]
+
+        for name, (elapsed, calls) in sorted(summary['sections'].items()):
+            lines.append(f'{name:<10} {elapsed:6.2f}ms {calls:5.1f}')
+
+        for key, val in sorted({**summary['counters'], **summary['gauges']}.items()):
+            lines.append(f'{key:<24} {val:7.1f}')
+
+        self.setText('\n'.join(lines))
+
+
+profiler = FrameProfiler()
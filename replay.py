@@ -0,0 +1,97 @@
+import json
+import random
+from typing import NamedTuple
+
+
+VERSION = 2
+
+
+class ReplayLog(NamedTuple):
+    """Args:
+            seed (int): passed to Drops.seed before the game starts.
+            fixed_dt (float): simulation time of a tick.
+            clicks (list): [tick, serial] of the clicked drops; serial is the number in the drop's name.
+            ticks (int): the length of the game.
+            score (int): the final score, to check that the replay did not diverge.
+            frames (list): [substeps, dt] of each frame of a game played on screen, whose frames run
+                a varying number of physics steps; None means a physics step of fixed_dt a frame.
+    """
+
+    seed: int
+    fixed_dt: float
+    clicks: list
+    ticks: int = 0
+    score: int = 0
+    frames: list = None
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict(version=VERSION, **self._asdict()), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+
+        # version 1 logs have no frames.
+        if (version := data.pop('version', None)) not in (1, VERSION):
+            raise ValueError(f'unsupported replay version: {version}')
+
+        return cls(**data)
+
+
+class Recorder:
+    """Record the seed of a game and the drops clicked in it.
+        Args:
+            seed (int): None means a random seed.
+            fixed_dt (float): simulation time of a tick.
+    """
+
+    def __init__(self, seed=None, fixed_dt=1 / 60):
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.fixed_dt = fixed_dt
+        self.clicks = []
+        self.frames = []
+
+    def click(self, tick, nd):
+        """Args:
+            tick (int): the number of physics steps since the game started.
+            nd (BulletRigidBodyNode): the clicked drop named drop_{serial}.
+        """
+        self.clicks.append([tick, int(nd.get_name().rpartition('_')[2])])
+
+    def frame(self, substeps, dt):
+        """Record a frame of a game played on screen; not needed if every frame runs a physics step.
+            Args:
+                substeps (int): the number of physics steps run in the frame.
+                dt (float): the seconds elapsed since the last frame.
+        """
+        self.frames.append([substeps, dt])
+
+    def log(self, ticks=0, score=0):
+        return ReplayLog(self.seed, self.fixed_dt, self.clicks[:], ticks, score, self.frames[:] or None)
+
+
+class ReplayPolicy:
+    """Click the drops recorded in the log at the recorded ticks;
+       used as the policy of HeadlessGame, which runs the physics steps of the recorded frames.
+        Args:
+            log (ReplayLog)
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.next_click = 0
+        self.missed = 0
+
+    def act(self, game):
+        clicks = self.log.clicks
+
+        while self.next_click < len(clicks) and clicks[self.next_click][0] <= game.tick:
+            _, serial = clicks[self.next_click]
+            self.next_click += 1
+
+            if (np := game.drops.find_drop(serial)) is not None:
+                game.click(np.node())
+            else:
+                self.missed += 1
@@ -0,0 +1,32 @@
+#version 150
+
+// Lambert lighting of a directional light casting shadows and an ambient light,
+// which is what the auto shader does for the drops having vertex colors and no material.
+
+uniform struct p3d_LightSourceParameters {
+    vec4 color;
+    vec4 position;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[1];
+
+uniform struct p3d_LightModelParameters {
+    vec4 ambient;
+} p3d_LightModel;
+
+in vec3 view_pos;
+in vec3 view_normal;
+in vec4 color;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    vec3 normal = normalize(view_normal);
+    vec4 light_pos = p3d_LightSource[0].position;
+    vec3 light_dir = normalize(light_pos.xyz - view_pos * light_pos.w);
+    float diffuse = max(dot(normal, light_dir), 0.0);
+    float lit = textureProj(p3d_LightSource[0].shadowMap, p3d_LightSource[0].shadowViewMatrix * vec4(view_pos, 1));
+
+    vec3 rgb = color.rgb * (p3d_LightModel.ambient.rgb + p3d_LightSource[0].color.rgb * diffuse * lit);
+    p3d_FragColor = vec4(rgb, color.a);
+}
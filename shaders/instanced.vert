@@ -0,0 +1,33 @@
+#version 150
+
+// Draw all of the drops of a stage in one call.
+// The buffer has 5 texels per instance: the 4 rows of the transform and the color scale.
+
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat4 p3d_ProjectionMatrix;
+uniform samplerBuffer instances;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+
+out vec3 view_pos;
+out vec3 view_normal;
+out vec4 color;
+
+void main() {
+    int base = gl_InstanceID * 5;
+    mat4 transform = mat4(
+        texelFetch(instances, base),
+        texelFetch(instances, base + 1),
+        texelFetch(instances, base + 2),
+        texelFetch(instances, base + 3)
+    );
+
+    vec4 pos = p3d_ModelViewMatrix * transform * p3d_Vertex;
+    view_pos = pos.xyz;
+    // the drops are scaled uniformly, so the normals do not need the inverse transpose.
+    view_normal = mat3(p3d_ModelViewMatrix) * mat3(transform) * p3d_Normal;
+    color = p3d_Color * texelFetch(instances, base + 4);
+    gl_Position = p3d_ProjectionMatrix * pos;
+}
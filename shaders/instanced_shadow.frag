@@ -0,0 +1,9 @@
+#version 150
+
+// Used in the shadow pass, which needs only the depth.
+
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = vec4(1.0);
+}
@@ -0,0 +1,11 @@
+#version 150
+
+uniform sampler2D p3d_Texture0;
+
+in vec2 texcoord;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = texture(p3d_Texture0, texcoord);
+}
@@ -0,0 +1,30 @@
+#version 150
+
+// Billboards of all of the effects using the same texture atlas.
+// p3d_Vertex is the center of a quad; corner has the offset of the vertex from the center in xy
+// and the scale of the quad in z; anim has the start time, the frame rate and the end frame of the effect.
+// The atlas frame is chosen from the frame time, and the quad is collapsed before the start and after the end.
+
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat4 p3d_ProjectionMatrix;
+uniform float osg_FrameTime;
+uniform vec2 grid;
+
+in vec4 p3d_Vertex;
+in vec3 corner;
+in vec3 anim;
+
+out vec2 texcoord;
+
+void main() {
+    float frame = floor((osg_FrameTime - anim.x) * anim.y);
+    float visible = float(frame >= 0.0 && frame < anim.z);
+
+    vec4 center = p3d_ModelViewMatrix * p3d_Vertex;
+    gl_Position = p3d_ProjectionMatrix * (center + vec4(corner.xy * corner.z * visible, 0, 0));
+
+    // u is mirrored, as the Effect quads turned to the camera by look_at were seen from behind.
+    float col = mod(frame, grid.x);
+    float row = floor(frame / grid.x);
+    texcoord = vec2((col - corner.x + 0.5) / grid.x, 1.0 - (row + 0.5 - corner.y) / grid.y);
+}
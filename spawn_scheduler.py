@@ -0,0 +1,79 @@
+from collections import deque
+
+
+class SpawnScheduler:
+    """Spawn the queued drops at a rate in simulation time, not once a frame,
+       so that a wave takes the same time however fast the frames are rendered.
+       Each drop spawned spends a credit, which is accumulated by the physics steps up to burst,
+       and several drops can be spawned in a frame while free positions are found.
+        Args:
+            drops (Drops): having drops_q and slots.
+            rate (float): the drops spawned per second.
+            burst (int): the maximum number of drops spawned in a frame.
+    """
+
+    def __init__(self, drops, rate=60, burst=3):
+        self.drops = drops
+        self.rate = rate
+        self.burst = burst
+        # the simulation time, and the time when each drop in drops_q was queued.
+        self.time = 0
+        self.times = deque()
+        self.credit = 0
+
+        self.spawned = 0
+        self.blocked = 0
+        self.total_latency = 0
+        self.max_latency = 0
+        self.max_queued = 0
+
+    def clear(self):
+        self.drops.drops_q.clear()
+        self.times.clear()
+        self.time = 0
+        self.credit = 0
+
+    def push(self, keys):
+        self.drops.drops_q.extend(keys)
+        self.times.extend(self.time for _ in range(len(keys)))
+        self.max_queued = max(self.max_queued, len(self.times))
+
+    def advance(self, dt):
+        """Add the time simulated by the last physics steps; call after physics steps."""
+        self.time += dt
+        self.credit = min(self.credit + self.rate * dt, self.burst)
+
+    def spawn(self):
+        """Spawn the drops at the head of drops_q as far as the credit and the free positions allow."""
+        slots = self.drops.slots
+
+        while self.credit >= 1 and self.times:
+            key = self.drops.drops_q[0]
+
+            # the spawned drops mark their cells at once, so the next ones do not overlap them.
+            if (pos := slots.find(self.drops.radius(key), self.drops.rng)) is None:
+                self.blocked += 1
+                break
+
+            self.drops.drops_q.popleft()
+            latency = self.time - self.times.popleft()
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.spawned += 1
+            self.credit -= 1
+
+            np = self.drops.copy_drop(self.drops.drops[key].model, pos)
+            slots.place(np)
+
+    def mean_latency(self):
+        return self.total_latency / self.spawned if self.spawned else 0
+
+    def stats(self):
+        return dict(
+            spawned=self.spawned,
+            blocked=self.blocked,
+            total_latency=self.total_latency
+        )
+
+    def levels(self):
+        return dict(queued=len(self.times))
@@ -0,0 +1,131 @@
+import math
+
+from panda3d.core import Point3
+
+
+class SpawnSlots:
+    """An occupancy map of the band where the drops are spawned, divided into cells along x.
+       A cell counts the drops overlapping it, updated from the transforms of the drops moved in physics steps,
+       so that a free position is found without sweep tests, and a jammed band is known at once.
+        Args:
+            drops (Drops)
+            dims (Dimensions): of the cabinet; the band is between its walls.
+            bottom (float): z of the spawn position.
+            top (float): z above which the drops come from.
+            margin (float): the radius of the biggest drop spawned; drops within it from the band are obstacles.
+            cell_width (float)
+    """
+
+    def __init__(self, drops, dims, bottom=16, top=19, margin=0.8, cell_width=0.25):
+        self.drops = drops
+        self.left = dims.left
+        self.bottom = bottom
+        self.top = top
+        self.margin = margin
+        self.cell_width = cell_width
+        self.n = math.floor((dims.right - dims.left) / cell_width)
+
+        self.lookups = 0
+        self.misses = 0
+        self.skipped = 0
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * self.n
+        self.entries = {}
+        self.free_cells = self.n
+        # incremented whenever a cell gets free.
+        self.version = 0
+        # (version, radius) of the last lookup that found no position.
+        self.jam = None
+        self.revision = None
+
+    def update(self):
+        """Place the drops moved since the last call; call after physics steps."""
+        self.drops.update_index(self)
+
+    def place(self, np):
+        """Mark the cells overlapped by np; also call when a drop is spawned, before the next physics step."""
+        nd = np.node()
+        pos = np.get_pos()
+        rad = self.drops.radius(nd.get_tag('stage'))
+        cells = None
+
+        if pos.z - rad < self.top + self.margin and pos.z + rad > self.bottom - self.margin:
+            lo = max(math.floor((pos.x - rad - self.left) / self.cell_width), 0)
+            hi = min(math.floor((pos.x + rad - self.left) / self.cell_width), self.n - 1)
+
+            if lo <= hi:
+                cells = (lo, hi)
+
+        if self.entries.get(nd) == cells:
+            return
+
+        if nd in self.entries:
+            self.remove(nd)
+
+        self.entries[nd] = cells
+
+        if cells is not None:
+            for i in range(cells[0], cells[1] + 1):
+                if self.counts[i] == 0:
+                    self.free_cells -= 1
+                self.counts[i] += 1
+
+    def remove(self, nd):
+        if (cells := self.entries.pop(nd)) is not None:
+            for i in range(cells[0], cells[1] + 1):
+                self.counts[i] -= 1
+
+                if self.counts[i] == 0:
+                    self.free_cells += 1
+                    self.version += 1
+
+    def is_jammed(self, radius):
+        """Return True if no position for radius can be free, without looking into the cells:
+           all of the cells are occupied, or no cell has got free since a lookup failed for a smaller radius.
+        """
+        if self.free_cells == 0:
+            return True
+
+        return self.jam is not None and self.jam[0] == self.version and radius >= self.jam[1]
+
+    def find(self, radius, rng):
+        """Return a random spawn position where a drop of radius overlaps no drop, or None if jammed.
+            Args:
+                rng (random.Random)
+        """
+        if self.is_jammed(radius):
+            self.skipped += 1
+            return None
+
+        self.lookups += 1
+        # the number of cells the drop covers.
+        k = math.ceil(radius * 2 / self.cell_width)
+        starts = []
+        run = 0
+
+        for i, count in enumerate(self.counts):
+            run = run + 1 if count == 0 else 0
+
+            if run >= k:
+                starts.append(i - k + 1)
+
+        if not starts:
+            self.misses += 1
+            self.jam = (self.version, radius)
+            return None
+
+        start = starts[rng.randrange(len(starts))]
+        x = self.left + (start + k / 2) * self.cell_width
+        return Point3(x, 0, self.bottom)
+
+    def stats(self):
+        return dict(
+            lookups=self.lookups,
+            misses=self.misses,
+            skipped=self.skipped
+        )
+
+    def levels(self):
+        return dict(free_cells=self.free_cells)
@@ -0,0 +1,162 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from panda3d.core import Filename, Texture, SamplerState
+
+
+COMPRESSIONS = dict(off=Texture.CM_off, dxt1=Texture.CM_dxt1, dxt5=Texture.CM_dxt5)
+
+
+class TextureManager:
+    """Load each texture once, and share it among its users.
+       Textures can be preloaded in background threads, and if mipmapped or compressed,
+       the processed variants are cached on disk to be loaded without processing next time.
+        Args:
+            texture_dir (str): relative to the current directory like objs and shaders.
+            cache_dir (str): the directory of the processed variants.
+            mipmap (bool): if True, mipmaps are generated; the frames of an atlas blur into
+                the next ones at the small mipmap levels.
+            compression (int): Texture.CM_*, such as Texture.CM_dxt5; CM_off keeps the images as they are.
+            workers (int): the number of threads loading in the background.
+    """
+
+    def __init__(self, texture_dir='textures', cache_dir='cache/textures', mipmap=False,
+                 compression=Texture.CM_off, workers=2):
+        self.texture_dir = texture_dir
+        self.cache_dir = cache_dir
+        self.mipmap = mipmap
+        self.compression = compression
+        self.workers = workers
+        self.textures = {}
+        self.futures = {}
+        self.executor = None
+
+    def preload(self, pattern='*.png'):
+        """Start loading the textures matching pattern in the texture directory in the background."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='texture')
+
+        for path in sorted(glob.glob(os.path.join(self.texture_dir, pattern))):
+            file_name = os.path.basename(path)
+
+            if file_name not in self.textures and file_name not in self.futures:
+                self.futures[file_name] = self.executor.submit(self.read, file_name)
+
+    def get(self, file_name):
+        """Return the texture, waiting for it if being preloaded, or loading it if not."""
+        if (tex := self.textures.get(file_name)) is None:
+            if (future := self.futures.pop(file_name, None)) is not None:
+                tex = future.result()
+            else:
+                tex = self.read(file_name)
+
+            self.textures[file_name] = tex
+
+        return tex
+
+    def is_loaded(self):
+        return all(future.done() for future in self.futures.values())
+
+    def progress(self):
+        """Return the number of textures loaded and the number requested."""
+        done = sum(future.done() for future in self.futures.values())
+        return len(self.textures) + done, len(self.textures) + len(self.futures)
+
+    def variant(self):
+        if self.mipmap or self.compression != Texture.CM_off:
+            name = next((k for k, v in COMPRESSIONS.items() if v == self.compression), self.compression)
+            return f'{"mip" if self.mipmap else "nomip"}_{name}'
+
+    def read(self, file_name):
+        src_path = os.path.abspath(os.path.join(self.texture_dir, file_name))
+
+        if (variant := self.variant()) is None:
+            return self.read_file(src_path)
+
+        stem = os.path.splitext(file_name)[0]
+        cache_path = os.path.abspath(os.path.join(self.cache_dir, f'{stem}.{variant}.txo'))
+
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(src_path):
+            return self.read_file(cache_path)
+
+        tex = self.read_file(src_path)
+        self.process(tex)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tex.write(Filename.from_os_specific(cache_path))
+        return tex
+
+    def read_file(self, path):
+        tex = Texture()
+
+        if not tex.read(Filename.from_os_specific(path)):
+            raise OSError(f'Cannot read texture: {path}')
+
+        return tex
+
+    def process(self, tex):
+        if self.mipmap:
+            tex.generate_ram_mipmap_images()
+            tex.set_minfilter(SamplerState.FT_linear_mipmap_linear)
+
+        if self.compression != Texture.CM_off:
+            tex.compress_ram_image(self.compression)
+
+    def memory(self):
+        """Return the bytes of each loaded texture, including its mipmaps; if the image has been released
+           from ram after being uploaded, the estimate of the uncompressed size is given.
+        """
+        sizes = {}
+
+        for file_name, tex in self.textures.items():
+            if tex.has_ram_image():
+                sizes[file_name] = sum(
+                    tex.get_ram_mipmap_image_size(i) for i in range(tex.get_num_ram_mipmap_images()))
+            else:
+                sizes[file_name] = tex.estimate_texture_memory()
+
+        return sizes
+
+    def clear(self):
+        for future in self.futures.values():
+            future.cancel()
+
+        self.futures.clear()
+        self.textures.clear()
+
+
+texture_manager = TextureManager()
+
+
+def configure(mipmap=False, compression='off'):
+    """Args:
+        compression (str): key of COMPRESSIONS.
+    """
+    texture_manager.mipmap = mipmap
+    texture_manager.compression = COMPRESSIONS[compression]
+
+
+def print_memory():
+    sizes = texture_manager.memory()
+
+    for file_name, size in sorted(sizes.items()):
+        print(f'{file_name:<20} {size / 1024 / 1024:>8.2f}MB')
+
+    print(f'{"total":<20} {sum(sizes.values()) / 1024 / 1024:>8.2f}MB')
+
+
+if __name__ == '__main__':
+    # make the cached variants in advance, and show the memory of the textures.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mipmap', action='store_true')
+    parser.add_argument('--compression', choices=COMPRESSIONS.keys(), default='off')
+    args = parser.parse_args()
+
+    configure(args.mipmap, args.compression)
+    texture_manager.preload()
+
+    for file_name in list(texture_manager.futures):
+        texture_manager.get(file_name)
+
+    print_memory()
@@ -1,9 +1,11 @@
 import logging
+import os
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
 
 from panda3d.core import LineSegs
 from panda3d.core import NodePath
+from panda3d.core import Filename, Shader
 
 
 def load_obj(file_path):
@@ -25,6 +27,15 @@ def load_obj(file_path):
     return vertices, faces
 
 
+def load_shader(vert_file, frag_file, shader_dir='shaders'):
+    """Load glsl shaders; the directory is relative to the current directory like textures and objs,
+       whichever script is run.
+    """
+    vert_path, frag_path = (
+        Filename.from_os_specific(os.path.abspath(os.path.join(shader_dir, f))) for f in (vert_file, frag_file))
+    return Shader.load(Shader.SL_GLSL, vertex=vert_path, fragment=frag_path)
+
+
 def make_line(from_pt, to_pt, color):
     lines = LineSegs()
     lines.set_color(color)
@@ -1,10 +1,22 @@
+import array
 from typing import NamedTuple
 
-from panda3d.core import NodePath
-from panda3d.core import Vec3
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from direct.showbase.ShowBaseGlobal import globalClock
+
+from panda3d.core import NodePath, GeomNode
+from panda3d.core import Vec2, Vec3
 from panda3d.core import ColorBlendAttrib, TextureStage
+from panda3d.core import Geom, GeomTriangles, GeomVertexArrayFormat, GeomVertexFormat, GeomVertexData
+from panda3d.core import OmniBoundingVolume
 
-from create_geomnode import TextureAtlasNode
+from profiler import profiler
+from texture_manager import texture_manager
+from utils import load_shader
 
 
 class TextureAtlas:
@@ -17,9 +29,7 @@ class TextureAtlas:
         self.cols = cols
 
     def load(self, file_name):
-        path = f'textures/{file_name}'
-        tex = base.loader.load_texture(path)
-        return tex
+        return texture_manager.get(file_name)
 
 
 class VFXSetting(NamedTuple):
@@ -27,184 +37,200 @@ class VFXSetting(NamedTuple):
     texture: TextureAtlas
     scale: float
     offset: Vec3 = Vec3(0, 0, 0)
-    hpr: Vec3 = Vec3(0, 0, 0)
 
     tgt_remove_row: int = None
     vfx_end_row: int = None
+    fps: float = 20
 
     @property
-    def tgt_remove_v(self):
-        if self.tgt_remove_row is not None:
-            return -self.texture.div_v * self.tgt_remove_row
-        return -self.texture.div_v * self.texture.rows
+    def end_frame(self):
+        """The index of the atlas frame at which an effect ends."""
+        row = self.texture.rows if self.vfx_end_row is None else self.vfx_end_row
+        return row * self.texture.cols
 
     @property
-    def vfx_end_v(self):
-        if self.vfx_end_row is not None:
-            return -self.texture.div_v * self.vfx_end_row
-        return -self.texture.div_v * self.texture.rows
-
-
-class Effect(NodePath):
+    def duration(self):
+        return self.end_frame / self.fps
 
-    def __init__(self, settings, target):
-        tex = settings.texture
-        super().__init__(TextureAtlasNode(tex.div_u, 1 - tex.div_v))
+    @property
+    def tgt_remove_time(self):
+        """Seconds from the first atlas frame of an effect until its target is removed,
+           which is after the last frame of the tgt_remove_row is shown.
+        """
+        row = self.texture.rows if self.tgt_remove_row is None else self.tgt_remove_row
+        return (row + 1) * self.texture.cols / self.fps
+
+
+class BillboardEffect:
+    """An effect drawn by BillboardBatch; the shader shows its atlas frames from the start time.
+        Args:
+            settings (VFXSetting)
+            target (NodePath): the drop exploding.
+            start (float): the frame time when the first atlas frame is shown.
+    """
+
+    __slots__ = ('pos', 'scale', 'start', 'fps', 'end_frame')
+
+    def __init__(self, settings, target, start):
+        self.pos = target.get_pos(base.render) + settings.offset
+        self.scale = settings.scale
+        self.start = start
+        self.fps = settings.fps
+        self.end_frame = settings.end_frame
+
+
+class BillboardBatch(NodePath):
+    """Draw all of the effects using the same texture atlas in a draw call.
+       The quads face the camera in the shader, which also chooses the atlas frame from the frame time,
+       so the vertices are written only when effects are added or removed.
+        Args:
+            atlas (TextureAtlas)
+            shader (Shader)
+    """
+
+    corners = ((-0.5, 0.5), (-0.5, -0.5), (0.5, 0.5), (0.5, -0.5))
+
+    def __init__(self, atlas, shader):
+        super().__init__(GeomNode('vfx_batch'))
+        self.atlas = atlas
+        self.effects = []
+
+        arr_format = GeomVertexArrayFormat()
+        arr_format.add_column('vertex', 3, Geom.NTFloat32, Geom.CPoint)
+        arr_format.add_column('corner', 3, Geom.NTFloat32, Geom.COther)
+        arr_format.add_column('anim', 3, Geom.NTFloat32, Geom.COther)
+        self.vdata = GeomVertexData('vfx', GeomVertexFormat.register_format(arr_format), Geom.UHDynamic)
+        self.prim = GeomTriangles(Geom.UHDynamic)
+        geom = Geom(self.vdata)
+        geom.add_primitive(self.prim)
+        self.node().add_geom(geom)
+
+        # the corners are moved in the shader, out of the bounds of the vertices.
+        self.node().set_bounds(OmniBoundingVolume())
+        self.node().set_final(True)
         self.set_attrib(ColorBlendAttrib.make(
             ColorBlendAttrib.M_add,
             ColorBlendAttrib.O_incoming_alpha,
             ColorBlendAttrib.O_one
         ))
-        self.set_texture(TextureStage.get_default(), tex.texture, 1)
+        self.set_texture(TextureStage.get_default(), atlas.texture, 1)
         self.set_bin('fixed', 40)
         self.set_depth_write(False)
         self.set_depth_test(False)
         self.set_light_off()
-        self.set_scale(settings.scale)
-        self.set_hpr(settings.hpr)
-
-        self.flatten_light()
-
-        self.target = target
-        self.pos_u = -tex.div_u
-        self.pos_v = 0
-
-        self.offset = settings.offset
-        self.tex = tex
-
-        self.tgt_remove_v = settings.tgt_remove_v
-        self.vfx_end_v = settings.vfx_end_v
-        self.settings = settings
-
-        self.force_stop = False
-
-    def run(self):
-        if self.force_stop:
-            return True
-
-        if self.target:
-            self.set_pos(self.target.get_pos(base.render) + self.offset)
-
-        self.pos_u += self.tex.div_u
-
-        # go to the next row
-        if self.pos_u >= 1.0:
-            self.pos_u = 0
-            self.pos_v -= self.tex.div_v
+        self.set_two_sided(True)
+        self.set_shader(shader)
+        self.set_shader_input('grid', Vec2(atlas.cols, atlas.rows))
 
-        # # comes to the end
-        if self.pos_v <= self.vfx_end_v:
-            return True
+    def add(self, effects):
+        self.effects.extend(effects)
+        self.write()
 
-        self.look_at(base.camera)
-        self.set_tex_offset(TextureStage.get_default(), self.pos_u, self.pos_v)
+    def remove(self, effects):
+        removed = set(effects)
+        self.effects = [effect for effect in self.effects if effect not in removed]
+        self.write()
 
-    def loop(self):
-        if self.target:
-            self.set_pos(self.target.get_pos(base.render) + self.offset)
+    def clear(self):
+        self.effects.clear()
+        self.write()
 
-        self.pos_u += self.tex.div_u
+    def write(self):
+        n = len(self.effects)
 
-        if self.pos_u >= 1.0:
-            self.pos_u = 0
-            self.pos_v -= self.tex.div_v
+        if numpy is not None and n:
+            rows = numpy.empty((n, 4, 9), dtype=numpy.float32)
+            rows[:, :, :3] = numpy.array(
+                [tuple(effect.pos) for effect in self.effects], dtype=numpy.float32)[:, None]
+            rows[:, :, 3:5] = self.corners
+            rows[:, :, 5:] = numpy.array(
+                [(effect.scale, effect.start, effect.fps, effect.end_frame) for effect in self.effects],
+                dtype=numpy.float32
+            )[:, None]
+            values = rows.reshape(-1)
+        else:
+            values = array.array('f')
 
-        self.look_at(base.camera)
-        self.set_tex_offset(TextureStage.get_default(), self.pos_u, self.pos_v)
+            for effect in self.effects:
+                x, y, z = effect.pos
 
-    def reset(self):
-        self.pos_u = -self.tex.div_u
-        self.pos_v = 0
+                for cx, cz in self.corners:
+                    values.extend((x, y, z, cx, cz, effect.scale, effect.start, effect.fps, effect.end_frame))
 
+        self.vdata.unclean_set_num_rows(n * 4)
 
-class VFX:
+        if n:
+            memoryview(self.vdata.modify_array(0)).cast('B').cast('f')[:] = memoryview(values).cast('B').cast('f')
 
-    def __init__(self, settings, target_np):
-        self.vfx = Effect(settings, target_np)
-        self.vfx.reparent_to(base.render)
-        self._finish = False
+        self.write_indices(n)
 
-    def start(self, delay=0.05):
-        base.taskMgr.do_method_later(delay, self._run, 'vfx')
+    def write_indices(self, n):
+        if self.prim.get_num_vertices() == n * 6:
+            return
 
-    def start_loop(self, delay=0.05):
-        base.taskMgr.do_method_later(delay, self._loop, 'loop')
+        indices = array.array('H')
 
-    def repeat_start(self, max_repeat, delay=0.05):
-        self._repeat_cnt = 0
-        self._max_repeat = max_repeat
-        base.taskMgr.do_method_later(delay, self._repeat, 'repeat')
+        for i in range(0, n * 4, 4):
+            # two triangles of a quad whose vertices are in the order of corners.
+            indices.extend((i + 2, i, i + 1, i + 2, i + 1, i + 3))
 
-    def _run(self, task):
-        if self.vfx.run():
-            self.vfx = self.vfx.remove_node()
-            return task.done
+        prim_array = self.prim.modify_vertices()
+        prim_array.unclean_set_num_rows(len(indices))
 
-        return task.again
-
-    def _loop(self, task):
-        self.vfx.loop()
-
-        if self._finish:
-            self.vfx = self.vfx.remove_node()
-            return task.done
-
-        return task.again
-
-    def _repeat(self, task):
-        if self.vfx.run():
-            self._repeat_cnt += 1
-            self.vfx.reset()
-
-        if self._repeat_cnt == self._max_repeat:
-            self.vfx = self.vfx.remove_node()
-            return task.done
-
-        return task.again
-
-    def finish(self):
-        self._finish = True
+        if indices:
+            memoryview(prim_array).cast('B').cast('H')[:] = indices
 
 
 class VFXHandler:
+    """Draw the effects of each texture atlas in a draw call. Nothing runs while the effects play;
+       tasks are scheduled at the start of effects to hand the targets over and to remove the effects.
+    """
 
-    def __init__(self, queue):
+    def __init__(self):
         self.root = NodePath('vfx_root')
         self.root.reparent_to(base.render)
-        self.drops_q = queue
+        self.batches = {}
+        self.shader = load_shader('vfx_billboard.vert', 'vfx_billboard.frag')
+
+    def get_batch(self, atlas):
+        if (batch := self.batches.get(atlas)) is None:
+            batch = self.batches[atlas] = BillboardBatch(atlas, self.shader)
+            batch.reparent_to(self.root)
+
+        return batch
+
+    def start(self, vfx_settings, *targets, delay=0.05):
+        """Args:
+            vfx_settings (VFXSetting)
+            targets (BulletRigidBodyNode): the drops exploding.
+            delay (float): seconds until the first atlas frame is shown.
+        """
+        start = globalClock.get_frame_time() + delay
+        target_nps = []
 
-    def make_effect(self, settings, *targets):
         for target in targets:
             target_np = NodePath(target)
             target_np.set_tag('effecting', '')
-            vfx = Effect(settings, target_np)
-            vfx.reparent_to(self.root)
-            yield vfx
-
-    def start(self, vfx_settings, *targets, delay=0.05):
-        effects = [vfx for vfx in self.make_effect(vfx_settings, *targets)]
-        base.taskMgr.do_method_later(delay, self.run, 'vfx', extraArgs=[effects], appendTask=True)
+            target_nps.append(target_np)
 
-    def run(self, effects, task):
-        if effects := [vfx for vfx in effects if not self.disappear(vfx)]:
-            return task.again
+        batch = self.get_batch(vfx_settings.texture)
+        effects = [BillboardEffect(vfx_settings, target_np, start) for target_np in target_nps]
+        batch.add(effects)
 
-        return task.done
+        base.taskMgr.do_method_later(
+            delay + vfx_settings.tgt_remove_time, self.remove_targets, 'vfx', extraArgs=[target_nps])
+        base.taskMgr.do_method_later(
+            delay + vfx_settings.duration, self.remove_effects, 'vfx', extraArgs=[batch, effects])
 
-    def disappear(self, vfx):
-        if vfx.pos_u + vfx.tex.div_u == 1.0 \
-                and vfx.pos_v == vfx.tgt_remove_v:
-            self.drops_q.append(vfx.target)
-            vfx.target = None
+    def remove_targets(self, target_nps):
+        base.messenger.send('targets-removed', [target_nps])
 
-        if vfx.run():
-            vfx.remove_node()
-            return True
+    def remove_effects(self, batch, effects):
+        with profiler.section('vfx'):
+            batch.remove(effects)
 
     def cleanup(self):
-        for task in base.taskMgr.getTasksNamed('vfx'):
-            args = task.getArgs()
-            vfx_li, _ = args
+        base.taskMgr.remove('vfx')
 
-            for vfx in vfx_li:
-                vfx.force_stop = True
+        for batch in self.batches.values():
+            batch.clear()